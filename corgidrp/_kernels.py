@@ -0,0 +1,405 @@
+"""
+Compiled kernels for hot loops in the pipeline
+
+numba is an optional dependency. If it is not installed, each function here falls back
+to an equivalent numpy implementation.
+"""
+import numpy as np
+from scipy.ndimage import median_filter, shift
+
+try:
+    from numba import njit, prange
+    from numba.typed import List
+    has_numba = True
+except ImportError:
+    has_numba = False
+
+# bottleneck is an optional dependency for faster medians
+try:
+    import bottleneck
+    has_bottleneck = True
+except ImportError:
+    has_bottleneck = False
+
+# below this number of frames, stacking in parallel isn't worth the overhead
+parallel_stack_min_frames = 64
+
+# size in bytes of the blocks of a stack that the numpy fallbacks reduce at a time, chosen to fit in cache
+reduction_tile_bytes = 4 * 1024**2
+
+
+def _native(arr):
+    """
+    numba cannot handle non-native byte order (e.g., big-endian data read from FITS files).
+    Returns a C-contiguous, native byte order version of the array, only copying if needed.
+
+    Args:
+        arr (np.array): input array
+
+    Returns:
+        np.array: native byte order, C-contiguous array
+    """
+    return np.ascontiguousarray(arr, dtype=arr.dtype.newbyteorder('='))
+
+
+if has_numba:
+    @njit(parallel=True)
+    def _stack_frames_numba(arrays, out):
+        for k in prange(len(arrays)):
+            # prange indices are unsigned, but typed List indexing expects signed integers
+            out[k] = arrays[np.int64(k)]
+
+    @njit(parallel=True)
+    def _masked_mean_axis0_numba(data, dq, out):
+        num_frames, num_pix = data.shape
+        for j in prange(num_pix):
+            total = 0.0
+            count = 0
+            for k in range(num_frames):
+                if dq[k, j] == 0:
+                    total += data[k, j]
+                    count += 1
+            if count > 0:
+                out[j] = total / count
+            else:
+                out[j] = np.nan
+
+    @njit(parallel=True)
+    def _nanmean_nanstd_axis0_numba(data, mean, std):
+        num_frames, num_pix = data.shape
+        for j in prange(num_pix):
+            # the second loop over this pixel's frames hits cache, so the stack is only read once from memory.
+            # The sums are accumulated in float64, so the results agree with np.nanmean/np.nanstd to
+            # floating point tolerance (exactly for float64 input, slightly more accurately for float32).
+            total = 0.0
+            count = 0
+            for k in range(num_frames):
+                val = data[k, j]
+                if not np.isnan(val):
+                    total += val
+                    count += 1
+            if count == 0:
+                mean[j] = np.nan
+                std[j] = np.nan
+                continue
+            avg = total / count
+            sq_total = 0.0
+            for k in range(num_frames):
+                val = data[k, j]
+                if not np.isnan(val):
+                    sq_total += (val - avg) * (val - avg)
+            mean[j] = avg
+            std[j] = np.sqrt(sq_total / count)
+
+    @njit(cache=True)
+    def _plateau_starts_numba(row, saturated, plat_val, out):
+        for n in range(len(saturated)):
+            i_beg = saturated[n]
+            while i_beg > 0 and row[i_beg] >= plat_val:
+                i_beg -= 1
+            # unless saturated at col 0, shifts forward 1 to plateau start
+            if row[i_beg] < plat_val:
+                i_beg += 1
+            out[n] = i_beg
+
+    @njit(cache=True)
+    def _rolling_median_numba(row, size, out):
+        n = len(row)
+        half = size // 2
+        window = np.empty(size, dtype=row.dtype)
+        for i in range(n):
+            # gather the window with edge values repeated past the ends, insertion sorting as we go
+            for w in range(size):
+                val = row[min(max(i - half + w, 0), n - 1)]
+                m = w
+                while m > 0 and window[m - 1] > val:
+                    window[m] = window[m - 1]
+                    m -= 1
+                window[m] = val
+            out[i] = window[half]
+
+    @njit(parallel=True)
+    def _streak_plateau_starts_numba(cube, streak_rows, size, sat_vals, plat_vals, out):
+        n_cols = cube.shape[2]
+        for k in prange(streak_rows.shape[0]):
+            row = cube[streak_rows[k, 0], streak_rows[k, 1]]
+            sat_val = sat_vals[k]
+            plat_val = plat_vals[k]
+            filtered = np.empty(n_cols, dtype=cube.dtype)
+            _rolling_median_numba(row, size, filtered)
+            for c in range(n_cols):
+                if filtered[c] >= sat_val:
+                    i_beg = c
+                    while i_beg > 0 and row[i_beg] >= plat_val:
+                        i_beg -= 1
+                    # unless saturated at col 0, shifts forward 1 to plateau start
+                    if row[i_beg] < plat_val:
+                        i_beg += 1
+                    out[k, i_beg] = True
+
+    @njit(cache=True)
+    def _shifted_template_ssd_numba(template, data, xshift, yshift, amp):
+        ny, nx = template.shape
+        total = 0.0
+        for i in range(ny):
+            y = i - yshift
+            # bilinear interpolation, with zeros outside of the template like scipy's mode='constant'
+            inside_y = y >= 0 and y <= ny - 1
+            y0 = int(np.floor(y)) if inside_y else 0
+            y1 = min(y0 + 1, ny - 1)
+            fy = y - y0
+            for j in range(nx):
+                x = j - xshift
+                val = 0.0
+                if inside_y and x >= 0 and x <= nx - 1:
+                    x0 = int(np.floor(x))
+                    x1 = min(x0 + 1, nx - 1)
+                    fx = x - x0
+                    val = ((1 - fy) * ((1 - fx) * template[y0, x0] + fx * template[y0, x1])
+                           + fy * ((1 - fx) * template[y1, x0] + fx * template[y1, x1]))
+                diff = data[i, j] - amp * val
+                total += diff * diff
+        return total
+
+
+def masked_mean_axis0(data, dq):
+    """
+    Mean of a stack of frames along the first axis, ignoring pixels with nonzero DQ.
+    Pixels that are bad in every frame are set to NaN.
+
+    Args:
+        data (np.array): N-D array of data, where the first dimension is the number of frames
+        dq (np.array): DQ array with the same shape as data. 0 is good.
+
+    Returns:
+        np.array: (N-1)-D array of the mean of the good pixels
+    """
+    if data.shape != dq.shape:
+        raise ValueError("data has shape {0} but dq has shape {1}".format(data.shape, dq.shape))
+
+    frame_shape = data.shape[1:]
+    # flatten each frame so the kernel works for any frame dimensionality
+    flat_data = data.reshape((data.shape[0], -1))
+    flat_dq = dq.reshape((dq.shape[0], -1))
+
+    if has_numba:
+        out = np.empty(flat_data.shape[1], dtype=np.float64)
+        _masked_mean_axis0_numba(_native(flat_data), _native(flat_dq), out)
+    else:
+        good = flat_dq == 0
+        num_good = np.sum(good, axis=0)
+        total = np.sum(flat_data, axis=0, where=good, dtype=np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out = total / num_good
+        out[num_good == 0] = np.nan
+
+    return out.reshape(frame_shape)
+
+
+def stack_frames(arrays, out):
+    """
+    Copies a list of equally shaped arrays into a preallocated array, where the first dimension indexes the input arrays.
+    For large numbers of frames, the copies are done in parallel with numba if it is installed and all arrays are
+    C-contiguous, native byte order, and of the same dtype and shape as out[0]. Otherwise, they are copied one at a time with numpy.
+
+    Args:
+        arrays (list): list of N arrays, each with shape out.shape[1:]
+        out (np.array): output array to copy into, with shape (N,) + the shape of each array
+    """
+    use_numba = has_numba and len(arrays) >= parallel_stack_min_frames and out.flags.c_contiguous \
+                and out.dtype.isnative and all(arr.dtype == out.dtype and arr.shape == out.shape[1:] and arr.flags.c_contiguous for arr in arrays)
+
+    if use_numba:
+        _stack_frames_numba(List(arrays), out)
+    else:
+        for k, arr in enumerate(arrays):
+            out[k] = arr
+
+
+def nanmean_nanstd_axis0(data):
+    """
+    Mean and standard deviation of a stack of frames along the first axis, ignoring NaNs.
+    Agrees with np.nanmean and np.nanstd to floating point tolerance, but with numba both are computed while reading
+    the data from memory once.
+
+    Args:
+        data (np.array): N-D array of data, where the first dimension is the number of frames
+
+    Returns:
+        tuple:
+            np.array: (N-1)-D array of the mean
+            np.array: (N-1)-D array of the standard deviation
+    """
+    frame_shape = data.shape[1:]
+    flat_data = data.reshape((data.shape[0], -1))
+    # like np.nanmean/np.nanstd, keep the precision of floating point input and return float64 otherwise
+    out_dtype = flat_data.dtype.newbyteorder('=') if flat_data.dtype.kind == 'f' else np.dtype(np.float64)
+
+    if has_numba:
+        # sums are accumulated in float64 regardless of the output precision
+        mean = np.empty(flat_data.shape[1], dtype=out_dtype)
+        std = np.empty(flat_data.shape[1], dtype=out_dtype)
+        _nanmean_nanstd_axis0_numba(_native(flat_data), mean, std)
+        return mean.reshape(frame_shape), std.reshape(frame_shape)
+
+    # work through blocks of pixels small enough to stay in cache between the mean and std passes
+    num_pix = flat_data.shape[1]
+    tile = max(1, reduction_tile_bytes // max(1, flat_data.shape[0] * flat_data.itemsize))
+    if tile >= num_pix:
+        return np.nanmean(data, axis=0), np.nanstd(data, axis=0)
+    mean = np.empty(num_pix, dtype=out_dtype)
+    std = np.empty_like(mean)
+    for start in range(0, num_pix, tile):
+        block = flat_data[:, start:start + tile]
+        mean[start:start + tile] = np.nanmean(block, axis=0)
+        std[start:start + tile] = np.nanstd(block, axis=0)
+    return mean.reshape(frame_shape), std.reshape(frame_shape)
+
+
+def plateau_starts(row, saturated, plat_val):
+    """
+    For each saturated index in a row, walks back to the start of the plateau it belongs to,
+    i.e., the first pixel of the run of pixels at or above plat_val that ends at that index.
+
+    Args:
+        row (np.array): 1-D row of pixel values
+        saturated (np.array): 1-D array of saturated pixel indices in the row
+        plat_val (float): value that determines the edges of a plateau
+
+    Returns:
+        np.array: 1-D int array of the plateau start of each saturated index
+    """
+    saturated = np.asarray(saturated, dtype=np.int64)
+
+    if has_numba:
+        out = np.empty(len(saturated), dtype=np.int64)
+        _plateau_starts_numba(_native(np.asarray(row)), saturated, plat_val, out)
+        return out
+
+    # the walk back stops at the last pixel at or before each index that is not part of the plateau
+    stops = ~(row >= plat_val)
+    last_stop = np.maximum.accumulate(np.where(stops, np.arange(len(row)), 0))[saturated]
+    # unless saturated at col 0, shifts forward 1 to plateau start
+    return last_stop + (row[last_stop] < plat_val)
+
+
+def rolling_median(row, size):
+    """
+    Running median of a 1-D row, equivalent to scipy.ndimage.median_filter(row, size, mode='nearest').
+    With numba, uses a small insertion sort per window, which is much faster than scipy for the short windows
+    used in cosmic ray filtering.
+
+    Args:
+        row (np.array): 1-D row of pixel values
+        size (int): window size
+
+    Returns:
+        np.array: 1-D array of the median filtered row
+    """
+    if has_numba:
+        row = _native(np.asarray(row))
+        out = np.empty_like(row)
+        _rolling_median_numba(row, size, out)
+        return out
+
+    return median_filter(row, size, mode='nearest')
+
+
+def streak_plateau_starts(cube, streak_rows, size, sat_val, plat_val):
+    """
+    Finds the beginning of each saturated plateau in a set of rows of a cube: the row is median filtered
+    with the given window size, and each pixel of the filtered row at or above sat_val is walked back to
+    the start of its plateau of pixels at or above plat_val.
+    With numba, the rows are processed in parallel.
+
+    Args:
+        cube (np.array): 3-D cube of image data
+        streak_rows (np.array): (N, 2) int array of the (frame, row) index of each row to search
+        size (int): median filter window size
+        sat_val (float or np.array): value at or above which filtered pixels are saturated, or an array of N of them,
+            one for each row
+        plat_val (float or np.array): value that determines the edges of a plateau, or an array of N of them
+
+    Returns:
+        np.array: (N, number of columns + 1) bool array that is True at the start of each plateau.
+            The extra column is for plateaus found to start just past the end of the row.
+    """
+    streak_rows = np.asarray(streak_rows, dtype=np.int64).reshape(-1, 2)
+    sat_vals = np.broadcast_to(np.asarray(sat_val, dtype=np.float64), streak_rows.shape[:1])
+    plat_vals = np.broadcast_to(np.asarray(plat_val, dtype=np.float64), streak_rows.shape[:1])
+    out = np.zeros((len(streak_rows), cube.shape[2] + 1), dtype=bool)
+
+    if has_numba:
+        _streak_plateau_starts_numba(_native(np.asarray(cube)), streak_rows, size,
+                                     np.ascontiguousarray(sat_vals), np.ascontiguousarray(plat_vals), out)
+        return out
+
+    for k, (j, i) in enumerate(streak_rows):
+        row = cube[j, i]
+        saturated = (rolling_median(row, size) >= sat_vals[k]).nonzero()[0]
+        out[k, plateau_starts(row, saturated, plat_vals[k])] = True
+    return out
+
+
+def shifted_template_ssd(template, data, xshift, yshift, amp):
+    """
+    Sum of squared differences between a data stamp and a template stamp that is shifted
+    with bilinear interpolation and scaled. Equivalent to
+    np.sum((data - amp * scipy.ndimage.shift(template, (yshift, xshift), order=1, prefilter=False))**2).
+    With numba, the shift and the sum are done in one pass without allocating the shifted template.
+
+    Args:
+        template (np.array): 2-D template stamp
+        data (np.array): 2-D data stamp, same shape as the template
+        xshift (float): shift of the template along x (columns), pixels
+        yshift (float): shift of the template along y (rows), pixels
+        amp (float): scale factor of the template
+
+    Returns:
+        float: sum of squared differences
+    """
+    template = np.asarray(template)
+    data = np.asarray(data)
+    # the numba kernel does no bounds checking, so a smaller data stamp (e.g. one truncated at the
+    # edge of the frame) must be rejected here rather than read out of bounds
+    if template.shape != data.shape:
+        raise ValueError("template stamp has shape {0} but data stamp has shape {1}".format(template.shape, data.shape))
+
+    if has_numba:
+        return _shifted_template_ssd_numba(_native(template), _native(data),
+                                           float(xshift), float(yshift), float(amp))
+
+    shifted_template = amp * shift(template, (yshift, xshift), order=1, prefilter=False)
+    return np.sum((data - shifted_template)**2)
+
+
+def median(arr, axis=None):
+    """
+    Median of an array along an axis. Uses bottleneck if it is installed, which is faster than np.median.
+
+    Args:
+        arr (np.array): input array
+        axis (int): axis to compute the median along. Default is None (the median of the flattened array)
+
+    Returns:
+        np.array: the median
+    """
+    if has_bottleneck:
+        return bottleneck.median(arr, axis=axis)
+    return np.median(arr, axis=axis)
+
+
+def nanmedian(arr, axis=None):
+    """
+    Median of an array along an axis, ignoring NaNs. Uses bottleneck if it is installed, which is faster than np.nanmedian.
+
+    Args:
+        arr (np.array): input array
+        axis (int): axis to compute the median along. Default is None (the median of the flattened array)
+
+    Returns:
+        np.array: the median
+    """
+    if has_bottleneck:
+        return bottleneck.nanmedian(arr, axis=axis)
+    return np.nanmedian(arr, axis=axis)
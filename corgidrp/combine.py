@@ -3,6 +3,7 @@ Module to support frame combination
 """
 import numpy as np
 import corgidrp.data as data
+import corgidrp._kernels as kernels
 
 
 def combine_images(data_subset, err_subset, dq_subset, collapse, num_frames_scaling):
@@ -34,7 +35,7 @@ def combine_images(data_subset, err_subset, dq_subset, collapse, num_frames_scal
         data_collapse = np.nanmean(data_subset, axis=0)
         err_collapse = np.sqrt(np.nanmean(err_subset**2, axis=0)) /np.sqrt(n_samples) # not sure if this is correct, but good enough for now
     elif collapse.lower() == "median":
-        data_collapse = np.nanmedian(data_subset, axis=0)
+        data_collapse = kernels.nanmedian(data_subset, axis=0)
         err_collapse = np.sqrt(np.nanmean(err_subset**2, axis=0)) /np.sqrt(n_samples) * np.sqrt(np.pi/2) # inflate median error
     if num_frames_scaling:
         # scale up by the number of frames
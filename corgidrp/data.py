@@ -1,4 +1,6 @@
 import os
+import datetime
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import numpy.ma as ma
 import astropy.io.fits as fits
@@ -6,6 +8,7 @@ import astropy.time as time
 import pandas as pd
 
 import corgidrp
+import corgidrp._kernels as kernels
 
 class Dataset():
     """
@@ -16,7 +19,7 @@ class Dataset():
 
     Attributes:
         all_data (np.array): an array with all the data combined together. First dimension is always number of images
-        frames (np.array): list of data objects (probably corgidrp.data.Image)
+        frames (list): list of data objects (probably corgidrp.data.Image)
     """
     def __init__(self, frames_or_filepaths):
         """
@@ -33,17 +36,31 @@ class Dataset():
             for filepath in frames_or_filepaths:
                 self.frames.append(Image(filepath))
         else:
-            # list of frames
-            self.frames = frames_or_filepaths
-
-        # turn lists into np.array for indexing behavior
-        if isinstance(self.frames, list):
-            self.frames = np.array(self.frames) # list of objects
+            # list of frames. make a new list so the caller's list isn't shared
+            self.frames = list(frames_or_filepaths)
 
         # create 3-D cube of all the data
-        self.all_data = np.array([frame.data for frame in self.frames])
-        self.all_err = np.array([frame.err for frame in self.frames])
-        self.all_dq = np.array([frame.dq for frame in self.frames])
+        # preallocate the cubes and copy each frame in directly to avoid an intermediate copy of every frame
+        num_frames = len(self.frames)
+        data_arrays = [frame.data for frame in self.frames]
+        # default (all zero) err and dq arrays that were never accessed don't need to be allocated, just zero-filled in the cube
+        err_arrays = [frame._err if isinstance(frame._err, _LazyZeros) else frame.err for frame in self.frames]
+        dq_arrays = [frame._dq if isinstance(frame._dq, _LazyZeros) else frame.dq for frame in self.frames]
+        data_shape = (num_frames,) + data_arrays[0].shape
+        data_dtype = np.result_type(*[arr.dtype for arr in data_arrays])
+        dq_shape = (num_frames,) + dq_arrays[0].shape
+        dq_dtype = np.result_type(*[arr.dtype for arr in dq_arrays])
+        # data and dq are views into a single contiguous memory pool, so one allocation backs both cubes
+        # and kernels that read both walk one block of memory. err is kept separate since it is
+        # regularly replaced wholesale (e.g., when error terms are added), which would leave dead space in the pool
+        dq_offset = _aligned_nbytes(np.prod(data_shape, dtype=int) * data_dtype.itemsize)
+        self._arena = np.empty(dq_offset + np.prod(dq_shape, dtype=int) * dq_dtype.itemsize, dtype=np.uint8)
+        self.all_data = self._arena[:dq_offset].view(data_dtype)[:np.prod(data_shape, dtype=int)].reshape(data_shape)
+        self.all_dq = self._arena[dq_offset:].view(dq_dtype).reshape(dq_shape)
+        self.all_err = np.empty((num_frames,) + err_arrays[0].shape, dtype=np.result_type(*[arr.dtype for arr in err_arrays]))
+        _fill_cube(self.all_data, data_arrays)
+        _fill_cube(self.all_err, err_arrays)
+        _fill_cube(self.all_dq, dq_arrays)
         # do a clever thing to point all the individual frames to the data in this cube
         # this way editing a single frame will also edit the entire datacube
         for i, frame in enumerate(self.frames):
@@ -55,23 +72,30 @@ class Dataset():
         return self.frames.__iter__()
 
     def __getitem__(self, indices):
-        if isinstance(indices, int):
+        if isinstance(indices, (int, np.integer)):
             # return a single element of the data
             return self.frames[indices]
-        else:
+        elif isinstance(indices, slice):
             # return a subset of the dataset
             return Dataset(self.frames[indices])
+        else:
+            # return a subset of the dataset using numpy indexing rules (index arrays, boolean masks)
+            return Dataset([self.frames[i] for i in np.arange(len(self.frames))[indices]])
 
     def __len__(self):
         return len(self.frames)
 
-    def save(self, filedir=None, filenames=None):
+    def save(self, filedir=None, filenames=None, parallel=True):
         """
         Save each file of data in this dataset into directory
 
         Args:
             filedir (str): directory to save the files. Default: the existing filedir for each file
             filenames (list): a list of output filenames for each file. Default: unchanged filenames
+            parallel (bool): write the files concurrently using a thread pool. Writing is I/O bound, so this
+                             is generally faster. Set to False to write them one at a time. If several frames
+                             are saved to the same path, they are always written one at a time, so the last
+                             frame wins. Default: True
 
         """
         # if filenames are not passed, use the default ones
@@ -81,8 +105,19 @@ class Dataset():
                 filename = frame.filename
                 filenames.append(frame.filename)
 
-        for filename, frame in zip(filenames, self.frames):
-            frame.save(filename=filename, filedir=filedir)
+        if parallel:
+            # concurrent writes to the same file could interleave and corrupt it
+            filepaths = [os.path.abspath(os.path.join(filedir if filedir is not None else frame.filedir, filename))
+                         for filename, frame in zip(filenames, self.frames)]
+            parallel = len(set(filepaths)) == len(filepaths)
+
+        if parallel:
+            with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+                # consume the iterator so that any exceptions get raised here
+                list(executor.map(lambda filename, frame: frame.save(filename=filename, filedir=filedir), filenames, self.frames))
+        else:
+            for filename, frame in zip(filenames, self.frames):
+                frame.save(filename=filename, filedir=filedir)
 
     def update_after_processing_step(self, history_entry, new_all_data=None, new_all_err = None, new_all_dq = None, header_entries = None):
         """
@@ -110,8 +145,10 @@ class Dataset():
             self.all_dq[:] = new_all_dq # specific operation overwrites the existing data rather than changing pointers
 
         # update history and header entries
+        # HISTORY cards can be duplicated, so append them directly and skip the keyword lookup done by __setitem__
+        history_card = ('HISTORY', history_entry)
         for img in self.frames:
-            img.ext_hdr['HISTORY'] = history_entry
+            img.ext_hdr.append(history_card, end=True)
             if header_entries:
                 for key, value in header_entries.items():
                     img.ext_hdr[key] = value
@@ -136,6 +173,16 @@ class Dataset():
 
         return new_dataset
 
+    def masked_mean(self):
+        """
+        Computes the mean of all frames in the dataset, ignoring pixels flagged in the DQ.
+        Pixels that are flagged in every frame are set to NaN.
+
+        Returns:
+            np.array: the mean of the good pixels across all frames. Same shape as a single frame
+        """
+        return kernels.masked_mean_axis0(self.all_data, self.all_dq)
+
     def add_error_term(self, input_error, err_name):
         """
         Calls Image.add_error_term() for each frame.
@@ -145,6 +192,20 @@ class Dataset():
           input_error (np.array): 2-d or 3-d error layer
           err_name (str): name of the uncertainty layer
         """
+        if not corgidrp.track_individual_errors and input_error.ndim in (2, 3) and self._err_is_linked():
+            # the error cube keeps its shape, so update the combined error of all frames at once in place.
+            # A 2-d error layer is broadcast over the frames rather than repeated for each one
+            expected_shape = self.all_data.shape[-2:] if input_error.ndim == 2 else (len(self.frames),) + self.all_data.shape[-2:]
+            if input_error.shape != expected_shape:
+                raise ValueError("we expect a {0}-dimensional error layer with dimensions {1}, but got {2}".format(
+                    input_error.ndim, expected_shape, input_error.shape))
+            combined_err = self.all_err[:, 0]
+            np.sqrt(combined_err**2 + input_error**2, out=combined_err)
+            for frame in self.frames:
+                frame.err_hdr["Layer_1"] = "combined_error"
+                frame.err_hdr['HISTORY'] = "Added error term: {0}".format(err_name)
+            return
+
         if input_error.ndim == 3:
             for i,frame in enumerate(self.frames):
                 frame.add_error_term(input_error[i], err_name)
@@ -161,6 +222,25 @@ class Dataset():
         for i, frame in enumerate(self.frames):
             frame.err = self.all_err[i]
 
+    def _err_is_linked(self):
+        """
+        Checks that the err of every frame is still the matching view into all_err, so all_err can be
+        updated in place.
+
+        Returns:
+            bool: True if every frame's err is all_err[i]
+        """
+        if not self.all_err.flags.c_contiguous:
+            return False
+        start = self.all_err.__array_interface__['data'][0]
+        for i, frame in enumerate(self.frames):
+            frame_err = frame._err
+            if (not isinstance(frame_err, np.ndarray) or frame_err.shape != self.all_err.shape[1:]
+                    or frame_err.dtype != self.all_err.dtype or not frame_err.flags.c_contiguous
+                    or frame_err.__array_interface__['data'][0] != start + i * self.all_err.strides[0]):
+                return False
+        return True
+
     def rescale_error(self, input_error, err_name):
         """
         Calls Image.rescale_errors() for each frame.
@@ -237,6 +317,117 @@ class Dataset():
 
 
 
+# default headers of the ERR and DQ extensions, when none are passed in
+_DEFAULT_ERR_HDR = fits.Header([("EXTNAME", "ERR")])
+_DEFAULT_DQ_HDR = fits.Header([("EXTNAME", "DQ")])
+
+def _now_isot():
+    """
+    Returns the current UTC time as an ISOT string, in the same format as astropy.time.Time.now().isot.
+    This gets called for every Image created or copied, so it is formatted with datetime rather than
+    going through the relatively expensive astropy Time machinery.
+
+    Returns:
+        str: the current time in ISOT format
+    """
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None).isoformat(timespec='milliseconds')
+
+def _fill_cube(cube, arrays):
+    """
+    Copies the array of each frame into a preallocated cube. Placeholders for all-zero arrays
+    are zero-filled in the cube directly, so they never need to be allocated.
+
+    Args:
+        cube (np.array): the cube to fill. First dimension is the number of frames
+        arrays (list): list of arrays (or corgidrp.data._LazyZeros) for each frame
+    """
+    if not any(isinstance(arr, _LazyZeros) for arr in arrays):
+        kernels.stack_frames(arrays, cube)
+    else:
+        for i, arr in enumerate(arrays):
+            if isinstance(arr, _LazyZeros):
+                cube[i] = 0
+            else:
+                cube[i] = arr
+
+def _aligned_nbytes(nbytes, alignment=64):
+    """
+    Rounds up a number of bytes to a multiple of the alignment, so that arrays placed
+    back to back in a memory pool all start at an offset that is aligned for any dtype
+
+    Args:
+        nbytes (int): number of bytes
+        alignment (int): alignment in bytes. Default is 64 (a cache line)
+
+    Returns:
+        int: the number of bytes rounded up to a multiple of alignment
+    """
+    return -(-nbytes // alignment) * alignment
+
+
+class _LazyZeros():
+    """
+    Placeholder for an all-zero array, used for the default err and dq of an Image.
+    These are frequently overwritten (e.g., when copied into a Dataset cube) before ever being
+    written to, so they are only allocated if they are actually accessed.
+
+    Args:
+        shape (tuple): shape of the array
+        dtype (np.dtype): data type of the array
+
+    Attributes:
+        shape (tuple): shape of the array
+        dtype (np.dtype): data type of the array
+    """
+    def __init__(self, shape, dtype):
+        self.shape = shape
+        self.dtype = np.dtype(dtype)
+
+    def load(self):
+        """
+        Allocates the array of zeros. This happens when the array is accessed, which usually means it is
+        about to be written to, so the memory is zeroed explicitly here rather than lazily by the OS (as np.zeros
+        does) to avoid page faults on the caller's subsequent writes.
+
+        Returns:
+            np.array: array of zeros
+        """
+        zeros = np.empty(self.shape, dtype=self.dtype)
+        zeros.fill(0)
+        return zeros
+
+
+class _LazyHDUData():
+    """
+    Placeholder for the array of a FITS extension that has not been read from disk yet.
+    Used by Image so that pixel data is only read in when it is first accessed.
+
+    Args:
+        filepath (str): path to the FITS file
+        ext (int or str): index or name of the extension in the FITS file
+        shape (tuple): shape of the array, as given by the extension header
+
+    Attributes:
+        filepath (str): path to the FITS file
+        ext (int or str): index or name of the extension in the FITS file
+        shape (tuple): shape of the array, as given by the extension header
+    """
+    def __init__(self, filepath, ext, shape):
+        self.filepath = filepath
+        self.ext = ext
+        self.shape = shape
+
+    def load(self):
+        """
+        Reads the array of the extension from disk
+
+        Returns:
+            np.array: the data of the extension
+        """
+        with fits.open(self.filepath, ignore_missing_simple=True, memmap=True) as hdulist:
+            return hdulist[self.ext].data
+
+
 class Image():
     """
     Base class for 2-D image data. Data can be created by passing in the data/header explicitly, or
@@ -265,25 +456,32 @@ class Image():
         filedir (str): the file directory on disk where this image is to be/already saved.
         filepath (str): full path to the file on disk (if it exists)
     """
+    # avoid a per-instance __dict__ since datasets can contain thousands of Images
+    # subclasses that add their own attributes will still get a __dict__
+    __slots__ = ('_data', '_err', '_dq', 'pri_hdr', 'ext_hdr', 'err_hdr', 'dq_hdr', 'hdu_list', 'hdu_names',
+                 'filename', 'filedir')
+
     def __init__(self, data_or_filepath, pri_hdr=None, ext_hdr=None, err = None, dq = None, err_hdr = None, dq_hdr = None, input_hdulist = None):
         if isinstance(data_or_filepath, str):
             # a filepath is passed in
-            with fits.open(data_or_filepath, ignore_missing_simple=True) as hdulist:
+            # only the headers are parsed here. Pixel data is read from disk when it is first accessed
+            with fits.open(data_or_filepath, ignore_missing_simple=True, memmap=True) as hdulist:
                 
                 #Pop out the primary header
                 self.pri_hdr = hdulist.pop(0).header
                 #Pop out the image extension
                 first_hdu = hdulist.pop(0)
                 self.ext_hdr = first_hdu.header
-                self.data = first_hdu.data
+                data_shape = first_hdu.shape
+                self._data = _LazyHDUData(data_or_filepath, 1, data_shape)
 
                 #A list of extensions
                 self.hdu_names = [hdu.name for hdu in hdulist]
 
                 # we assume that if the err and dq array is given as parameter they supersede eventual err and dq extensions
                 if err is not None:
-                    if np.shape(self.data) != np.shape(err)[-self.data.ndim:]:
-                        raise ValueError("The shape of err is {0} while we are expecting shape {1}".format(err.shape[-self.data.ndim:], self.data.shape))
+                    if err.shape[-len(data_shape):] != data_shape:
+                        raise ValueError("The shape of err is {0} while we are expecting shape {1}".format(err.shape[-len(data_shape):], data_shape))
                     #we want to have a 3 dim error array
                     if err.ndim > 2:
                         self.err = err
@@ -291,24 +489,25 @@ class Image():
                         self.err = err.reshape((1,)+err.shape)
                 elif "ERR" in self.hdu_names:
                     err_hdu = hdulist.pop("ERR")
-                    self.err = err_hdu.data
+                    err_shape = err_hdu.shape
+                    if len(err_shape) == 2:
+                        err_shape = (1,)+err_shape
+                    self._err = _LazyHDUData(data_or_filepath, "ERR", err_shape)
                     self.err_hdr = err_hdu.header
-                    if self.err.ndim == 2:
-                        self.err = self.err.reshape((1,)+self.err.shape)
                 else:
-                    self.err = np.zeros((1,)+self.data.shape)
+                    self.err = _LazyZeros((1,)+data_shape, np.float64)
 
                 if dq is not None:
-                    if np.shape(self.data) != np.shape(dq):
-                        raise ValueError("The shape of dq is {0} while we are expecting shape {1}".format(dq.shape, self.data.shape))
+                    if dq.shape != data_shape:
+                        raise ValueError("The shape of dq is {0} while we are expecting shape {1}".format(dq.shape, data_shape))
                     self.dq = dq
                 
                 elif "DQ" in self.hdu_names:
                     dq_hdu = hdulist.pop("DQ")
-                    self.dq = dq_hdu.data
+                    self.dq = _LazyHDUData(data_or_filepath, "DQ", dq_hdu.shape)
                     self.dq_hdr = dq_hdu.header
                 else:
-                    self.dq = np.zeros(self.data.shape, dtype = int)
+                    self.dq = _LazyZeros(data_shape, int)
 
 
                 if input_hdulist is not None:
@@ -318,14 +517,9 @@ class Image():
                     self.hdu_list = hdulist
 
             # parse the filepath to store the filedir and filename
-            filepath_args = data_or_filepath.split(os.path.sep)
-            if len(filepath_args) == 1:
-                # no directory info in filepath, so current working directory
-                self.filedir = "."
-                self.filename = filepath_args[0]
-            else:
-                self.filename = filepath_args[-1]
-                self.filedir = os.path.sep.join(filepath_args[:-1])
+            filedir, self.filename = os.path.split(data_or_filepath)
+            # no directory info in filepath means current working directory
+            self.filedir = filedir or "."
 
         else:
             # data has been passed in directly
@@ -341,7 +535,7 @@ class Image():
             # self.hdu_names = [hdu.name for hdu in self.hdu_list]
 
             if err is not None:
-                if np.shape(self.data) != np.shape(err)[-self.data.ndim:]:
+                if self.data.shape != err.shape[-self.data.ndim:]:
                     raise ValueError("The shape of err is {0} while we are expecting shape {1}".format(err.shape[-self.data.ndim:], self.data.shape))
                 #we want to have a 3 dim error array
                 if err.ndim > 2:
@@ -349,14 +543,14 @@ class Image():
                 else:
                     self.err = err.reshape((1,)+err.shape)
             else:
-                self.err = np.zeros((1,)+self.data.shape)
+                self.err = _LazyZeros((1,)+self.data.shape, np.float64)
 
             if dq is not None:
-                if np.shape(self.data) != np.shape(dq):
+                if self.data.shape != dq.shape:
                     raise ValueError("The shape of dq is {0} while we are expecting shape {1}".format(dq.shape, self.data.shape))
                 self.dq = dq
             else:
-                self.dq = np.zeros(self.data.shape, dtype = int)
+                self.dq = _LazyZeros(self.data.shape, int)
 
             #The default hdu extensions
             self.hdu_names = ["ERR", "DQ"]
@@ -377,7 +571,7 @@ class Image():
 
             # record when this file was created and with which version of the pipeline
             self.ext_hdr.set('DRPVERSN', corgidrp.__version__, "corgidrp version that produced this file")
-            self.ext_hdr.set('DRPCTIME', time.Time.now().isot, "When this file was saved")
+            self.ext_hdr.set('DRPCTIME', _now_isot(), "When this file was saved")
 
         
         # we assume that if the err_hdr and dq_hdr is given as parameter they supersede eventual existing err_hdr and dq_hdr
@@ -385,20 +579,28 @@ class Image():
             self.err_hdr = err_hdr
         if dq_hdr is not None:
             self.dq_hdr = dq_hdr
+        # copying the prebuilt default headers is cheaper than building and validating new cards for every Image
         if not hasattr(self, 'err_hdr'):
-            self.err_hdr = fits.Header()
-        self.err_hdr["EXTNAME"] = "ERR"
+            self.err_hdr = _DEFAULT_ERR_HDR.copy()
+        else:
+            self.err_hdr["EXTNAME"] = "ERR"
         if not hasattr(self, 'dq_hdr'):
-            self.dq_hdr = fits.Header()
-        self.dq_hdr["EXTNAME"] = "DQ"
+            self.dq_hdr = _DEFAULT_DQ_HDR.copy()
+        else:
+            self.dq_hdr["EXTNAME"] = "DQ"
 
         # discard individual errors if we aren't tracking them but multiple error terms are passed in
-        if not corgidrp.track_individual_errors and self.err.shape[0] > 1:
-            num_errs = self.err.shape[0] - 1
+        # the shape is checked on the (possibly not yet loaded) backing array to avoid reading it from disk
+        if not corgidrp.track_individual_errors and self._err.shape[0] > 1:
+            num_errs = self._err.shape[0] - 1
             # delete keywords specifying the error of each individual slice
             for i in range(num_errs):
                 del self.err_hdr['Layer_{0}'.format(i + 2)]
-            self.err = self.err[:1] # only save the total err, preserve 3-D shape
+            if isinstance(self._err, _LazyHDUData):
+                # only the total err will be read in, preserve 3-D shape
+                self._err.shape = (1,) + self._err.shape[1:]
+            else:
+                self.err = self.err[:1] # only save the total err, preserve 3-D shape
         self.err_hdr['TRK_ERRS'] = corgidrp.track_individual_errors # specify whether we are tracing errors
 
         # the DRP needs to make sure certain keywords are set in its reduced products
@@ -415,6 +617,40 @@ class Image():
 
 
 
+    @property
+    def data(self):
+        if isinstance(self._data, (_LazyZeros, _LazyHDUData)):
+            self._data = self._data.load()
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+
+    @property
+    def err(self):
+        if isinstance(self._err, (_LazyZeros, _LazyHDUData)):
+            num_layers = self._err.shape[0]
+            err = self._err.load()
+            if err.ndim == 2:
+                err = err.reshape((1,)+err.shape)
+            self._err = err[:num_layers]
+        return self._err
+
+    @err.setter
+    def err(self, value):
+        self._err = value
+
+    @property
+    def dq(self):
+        if isinstance(self._dq, (_LazyZeros, _LazyHDUData)):
+            self._dq = self._dq.load()
+        return self._dq
+
+    @dq.setter
+    def dq(self, value):
+        self._dq = value
+
     # create this field dynamically
     @property
     def filepath(self):
@@ -437,16 +673,11 @@ class Image():
         if len(self.filename) == 0:
             raise ValueError("Output filename is not defined. Please specify!")
 
-        prihdu = fits.PrimaryHDU(header=self.pri_hdr)
-        exthdu = fits.ImageHDU(data=self.data, header=self.ext_hdr)
-        hdulist = fits.HDUList([prihdu, exthdu])
-
-        errhdu = fits.ImageHDU(data=self.err, header = self.err_hdr)
-        hdulist.append(errhdu)
-
-        dqhdu = fits.ImageHDU(data=self.dq, header = self.dq_hdr)
-        hdulist.append(dqhdu)
-
+        hdulist = fits.HDUList([fits.PrimaryHDU(header=self.pri_hdr),
+                                fits.ImageHDU(data=self.data, header=self.ext_hdr),
+                                fits.ImageHDU(data=self.err, header=self.err_hdr),
+                                fits.ImageHDU(data=self.dq, header=self.dq_hdr)])
+        # append (rather than pass to the constructor) so any extra primary HDUs are converted to extensions
         for hdu in self.hdu_list:
             hdulist.append(hdu)
 
@@ -490,25 +721,59 @@ class Image():
             corgidrp.data.Image: a copy of this Image
         """
         if copy_data:
-            new_data = np.copy(self.data)
-            new_err = np.copy(self.err)
-            new_dq = np.copy(self.dq)
+            new_data = self.data.copy(order='C')
+            new_err = self.err.copy(order='C')
+            new_dq = self.dq.copy(order='C')
             new_hdulist = self.hdu_list.copy()
         else:
             new_data = self.data # this is just pointer referencing
             new_err = self.err
             new_dq = self.dq
             new_hdulist = self.hdu_list
-        new_img = Image(new_data, pri_hdr=self.pri_hdr.copy(), ext_hdr=self.ext_hdr.copy(), err = new_err, dq = new_dq, 
-                        input_hdulist = new_hdulist, err_hdr = self.err_hdr.copy(), dq_hdr = self.dq_hdr.copy())
-
-        # annoying, but we got to manually update some parameters. Need to keep track of which ones to update
-        new_img.filename = self.filename
-        new_img.filedir = self.filedir
+        # this Image has already been validated, so skip the checks in the constructor
+        new_img = Image._from_views(new_data, new_err, new_dq, self.pri_hdr.copy(), self.ext_hdr.copy(), self.err_hdr.copy(),
+                                    self.dq_hdr.copy(), new_hdulist, self.filename, self.filedir)
 
         # update DRP version tracking
-        self.ext_hdr['DRPVERSN'] =  corgidrp.__version__
-        self.ext_hdr['DRPCTIME'] =  time.Time.now().isot
+        new_img.ext_hdr['DRPVERSN'] =  corgidrp.__version__
+        new_img.ext_hdr['DRPCTIME'] =  _now_isot()
+
+        return new_img
+
+    @classmethod
+    def _from_views(cls, data, err, dq, pri_hdr, ext_hdr, err_hdr, dq_hdr, hdu_list, filename, filedir):
+        """
+        Creates an Image directly from arrays and headers that are already known to be consistent,
+        bypassing the shape checks and header bookkeeping in the constructor. The arrays and headers are
+        stored as is, without copying.
+
+        Args:
+            data (np.array): 2-D data
+            err (np.array): 3-D uncertainty
+            dq (np.array): 2-D data quality
+            pri_hdr (astropy.io.fits.Header): the primary header
+            ext_hdr (astropy.io.fits.Header): the image extension header
+            err_hdr (astropy.io.fits.Header): the error extension header
+            dq_hdr (astropy.io.fits.Header): the data quality extension header
+            hdu_list (astropy.io.fits.HDUList): HDUList of any other extensions
+            filename (str): the filename corresponding to this Image
+            filedir (str): the file directory on disk for this Image
+
+        Returns:
+            corgidrp.data.Image: the new Image
+        """
+        new_img = cls.__new__(cls)
+        new_img.data = data
+        new_img.err = err
+        new_img.dq = dq
+        new_img.pri_hdr = pri_hdr
+        new_img.ext_hdr = ext_hdr
+        new_img.err_hdr = err_hdr
+        new_img.dq_hdr = dq_hdr
+        new_img.hdu_list = hdu_list
+        new_img.hdu_names = ["ERR", "DQ"] + [hdu.name for hdu in hdu_list]
+        new_img.filename = filename
+        new_img.filedir = filedir
 
         return new_img
 
@@ -610,7 +875,46 @@ class Image():
             self.hdu_list.append(new_hdu)
 
 
-class Dark(Image):
+class _CalibMixin():
+    """
+    Shared bookkeeping for calibration classes when a new calibration file is created from an input dataset.
+    Subclasses set the class attributes below.
+
+    Attributes:
+        _DATATYPE (str): value of the DATATYPE header keyword for this calibration type
+        _HISTORY_FMT (str): history entry added on creation. Formatted with the extension header as `hdr`
+        _FILENAME_SUFFIX (str): suffix appended to the name of the first input file to make the default filename
+    """
+    __slots__ = ()
+    _DATATYPE = ''
+    _HISTORY_FMT = ''
+    _FILENAME_SUFFIX = ''
+
+    def _finalize_new(self, input_dataset, record_parents=True):
+        """
+        Sets the DATATYPE, records the input files, adds a history entry, and sets the default filename
+
+        Args:
+            input_dataset (corgidrp.data.Dataset): the Image files combined together to make this calibration file
+            record_parents (bool): whether to record the filenames of input_dataset in the header. Default is True
+        """
+        self.ext_hdr['DATATYPE'] = self._DATATYPE # corgidrp specific keyword for saving to disk
+
+        # log all the data that went into making this calibration file
+        if record_parents:
+            self._record_parent_filenames(input_dataset)
+
+        # add to history
+        self.ext_hdr.append(('HISTORY', self._HISTORY_FMT.format(hdr=self.ext_hdr)), end=True)
+
+        # give it a default filename using the first input file as the base
+        # strip off everything starting at .fits
+        if input_dataset is not None:
+            orig_input_filename = input_dataset[0].filename.split(".fits")[0]
+            self.filename = "{0}_{1}.fits".format(orig_input_filename, self._FILENAME_SUFFIX)
+
+
+class Dark(_CalibMixin, Image):
     """
     Dark calibration frame for a given exposure time and EM gain.
 
@@ -623,6 +927,11 @@ class Dark(Image):
         err_hdr (astropy.io.fits.Header): the error header (required only if raw data is passed in)
         dq (np.array): the DQ array (required only if raw data is passed in)
     """
+    __slots__ = ()
+    _DATATYPE = 'Dark'
+    _HISTORY_FMT = "Dark with exptime = {hdr[EXPTIME]} s and commanded EM gain = {hdr[CMDGAIN]} created from {hdr[DRPNFILE]} frames"
+    _FILENAME_SUFFIX = 'dark'
+
     def __init__(self, data_or_filepath, pri_hdr=None, ext_hdr=None, input_dataset=None, err = None, dq = None, err_hdr = None):
        # run the image class contructor
         super().__init__(data_or_filepath, pri_hdr=pri_hdr, ext_hdr=ext_hdr, err=err, dq=dq, err_hdr=err_hdr)
@@ -633,20 +942,9 @@ class Dark(Image):
             if input_dataset is None and 'DRPNFILE' not in ext_hdr.keys():
                 # error check. this is required in this case
                 raise ValueError("This appears to be a new dark. The dataset of input files needs to be passed in to the input_dataset keyword to record history of this dark.")
-            self.ext_hdr['DATATYPE'] = 'Dark' # corgidrp specific keyword for saving to disk
             self.ext_hdr['BUNIT'] = 'detected electrons'
-
-            # log all the data that went into making this calibration file
-            if 'DRPNFILE' not in ext_hdr.keys():
-                self._record_parent_filenames(input_dataset)
-
-            # add to history
-            self.ext_hdr['HISTORY'] = "Dark with exptime = {0} s and commanded EM gain = {1} created from {2} frames".format(self.ext_hdr['EXPTIME'], self.ext_hdr['CMDGAIN'], self.ext_hdr['DRPNFILE'])
-
-            # give it a default filename using the first input file as the base
-            # strip off everything starting at .fits
-            orig_input_filename = input_dataset[0].filename.split(".fits")[0]
-            self.filename = "{0}_dark.fits".format(orig_input_filename)
+            # the input files only need to be logged if they haven't been already
+            self._finalize_new(input_dataset, record_parents='DRPNFILE' not in ext_hdr.keys())
 
         if err_hdr is not None:
             self.err_hdr['BUNIT'] = 'detected electrons'
@@ -686,7 +984,7 @@ class Dark(Image):
 
         # update DRP version tracking
         self.ext_hdr['DRPVERSN'] =  corgidrp.version
-        self.ext_hdr['DRPCTIME'] =  time.Time.now().isot
+        self.ext_hdr['DRPCTIME'] =  _now_isot()
 
         return new_dark
 
@@ -731,7 +1029,7 @@ class FlatField(Image):
             raise ValueError("File that was loaded was not a FlatField file.")
 
 
-class NonLinearityCalibration(Image):
+class NonLinearityCalibration(_CalibMixin, Image):
     """
     Class for non-linearity calibration files. Although it's not strictly an image that you might look at, it is a 2D array of data
 
@@ -774,6 +1072,11 @@ class NonLinearityCalibration(Image):
         together to make this NonLinearityCalibration file (required only if 
         raw 2D data is passed in)
     """
+    __slots__ = ()
+    _DATATYPE = 'NonLinearityCalibration'
+    _HISTORY_FMT = "Non Linearity Calibration file created"
+    _FILENAME_SUFFIX = 'NonLinearityCalibration'
+
     def __init__(self, data_or_filepath, pri_hdr=None, ext_hdr=None, 
                  input_dataset=None):
 
@@ -803,19 +1106,7 @@ class NonLinearityCalibration(Image):
                                  "Correction. The dataset of input files needs" 
                                  "to be passed in to the input_dataset keyword" 
                                  "to record history of this calibration file.")
-            # corgidrp specific keyword for saving to disk
-            self.ext_hdr['DATATYPE'] = 'NonLinearityCalibration' 
-
-            # log all the data that went into making this calibration file
-            self._record_parent_filenames(input_dataset)
-
-            # add to history
-            self.ext_hdr['HISTORY'] = "Non Linearity Calibration file created"
-
-            # give it a default filename using the first input file as the base
-            # strip off everything starting at .fits
-            orig_input_filename = input_dataset[0].filename.split(".fits")[0]
-            self.filename = "{0}_NonLinearityCalibration.fits".format(orig_input_filename)
+            self._finalize_new(input_dataset)
 
 
         # double check that this is actually a NonLinearityCalibration file that got read in
@@ -940,7 +1231,7 @@ class KGain(Image):
 
         # update DRP version tracking
         self.ext_hdr['DRPVERSN'] =  corgidrp.__version__
-        self.ext_hdr['DRPCTIME'] =  time.Time.now().isot
+        self.ext_hdr['DRPCTIME'] =  _now_isot()
         
         return new_kg
 
@@ -961,15 +1252,10 @@ class KGain(Image):
         if len(self.filename) == 0:
             raise ValueError("Output filename is not defined. Please specify!")
 
-        prihdu = fits.PrimaryHDU(header=self.pri_hdr)
-        exthdu = fits.ImageHDU(data=self.data, header=self.ext_hdr)
-        hdulist = fits.HDUList([prihdu, exthdu])
-
-        errhdu = fits.ImageHDU(data=self.err, header = self.err_hdr)
-        hdulist.append(errhdu)
-
-        ptchdu = fits.ImageHDU(data=self.ptc, header = self.ptc_hdr)
-        hdulist.append(ptchdu)
+        hdulist = fits.HDUList([fits.PrimaryHDU(header=self.pri_hdr),
+                                fits.ImageHDU(data=self.data, header=self.ext_hdr),
+                                fits.ImageHDU(data=self.err, header=self.err_hdr),
+                                fits.ImageHDU(data=self.ptc, header=self.ptc_hdr)])
 
         hdulist.writeto(self.filepath, overwrite=True)
         hdulist.close()
@@ -1043,7 +1329,7 @@ class BadPixelMap(Image):
 
         # update DRP version tracking
         self.ext_hdr['DRPVERSN'] =  corgidrp.__version__
-        self.ext_hdr['DRPCTIME'] =  time.Time.now().isot
+        self.ext_hdr['DRPCTIME'] =  _now_isot()
 
         return new_bp
 
@@ -1155,7 +1441,7 @@ class DetectorNoiseMaps(Image):
 
         # update DRP version tracking
         self.ext_hdr['DRPVERSN'] =  corgidrp.version
-        self.ext_hdr['DRPCTIME'] =  time.Time.now().isot
+        self.ext_hdr['DRPCTIME'] =  _now_isot()
 
         return new_nm
 
@@ -1231,7 +1517,7 @@ class DetectorParams(Image):
             exthdr = fits.Header()
             exthdr['SCTSRT'] = date_valid.isot # use this for validity date
             exthdr['DRPVERSN'] =  corgidrp.__version__
-            exthdr['DRPCTIME'] =  time.Time.now().isot
+            exthdr['DRPCTIME'] =  _now_isot()
 
             # fill caldb required keywords with dummy data
             prihdr['OBSID'] = 0
@@ -1420,18 +1706,20 @@ def autoload(filepath):
         corgidrp.data.* : an instance of one of the data classes specified here
     """
 
-    with fits.open(filepath) as hdulist:
+    # only the headers are needed to dispatch, so make sure no pixel data gets read or rescaled here
+    with fits.open(filepath, memmap=True, lazy_load_hdus=True, do_not_scale_image_data=True) as hdulist:
+        ext_hdr = hdulist[1].header
         # check the exthdr for datatype
-        if 'DATATYPE' in hdulist[1].header:
-            dtype = hdulist[1].header['DATATYPE']
+        if 'DATATYPE' in ext_hdr:
+            dtype = ext_hdr['DATATYPE']
         else:
             # datatype not specified. Check if it's 2D
-            if len(hdulist[1].data.shape) == 2:
+            if ext_hdr.get('NAXIS', 0) == 2:
                 # a standard image (possibly a science frame)
                 dtype = "Image"
             else:
-                errmsg = "Could not determine datatype for {0}. Data shape of {1} is not 2-D"
-                raise ValueError(errmsg.format(filepath, dtype))
+                errmsg = "Could not determine datatype for {0}. Data has {1} dimensions, not 2"
+                raise ValueError(errmsg.format(filepath, ext_hdr.get('NAXIS', 0)))
 
     # if we got here, we have a datatype
     data_class = datatypes[dtype]
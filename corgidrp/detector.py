@@ -1,8 +1,8 @@
 # Place to put detector-related utility functions
 
+import functools
+from dataclasses import dataclass
 import numpy as np
-from scipy import interpolate
-from scipy.ndimage import median_filter
 from scipy.ndimage import gaussian_filter as gauss
 from scipy import ndimage
 from scipy.signal import convolve2d
@@ -12,8 +12,9 @@ import photutils.centroids as centr
 from photutils.aperture import CircularAperture
 
 import corgidrp.data as data
+import corgidrp._kernels as kernels
 
-def create_flatfield(flat_dataset):
+def create_flatfield(flat_dataset, downsample=1):
 
     """
     Turn this dataset of image frames that were taken for performing the flat calibration and
@@ -22,24 +23,51 @@ def create_flatfield(flat_dataset):
 
     Args:
        flat_dataset (corgidrp.data.Dataset): a dataset of Image frames (L2a-level)
+       downsample (int): if greater than 1, only every downsample-th pixel along each axis is used to
+            compute the flat and its error, which are then expanded back to the full frame size by
+            repeating each value. Much faster for large frames when a coarse flat is sufficient. Defaults to 1.
 
     Returns:
         flat_field (corgidrp.data.FlatField): a master flat for flat calibration
     """
+    if downsample < 1:
+        raise ValueError("downsample must be at least 1, got {0}".format(downsample))
 
-
-    combined_frame = np.nanmean(flat_dataset.all_data, axis=0)
+    if downsample == 1:
+        combined_frame, frame_std = kernels.nanmean_nanstd_axis0(flat_dataset.all_data)
+    else:
+        frame_shape = flat_dataset.all_data.shape[1:]
+        coarse_frame, coarse_std = kernels.nanmean_nanstd_axis0(
+            flat_dataset.all_data[:, ::downsample, ::downsample])
+        combined_frame = _expand_downsampled(coarse_frame, downsample, frame_shape)
+        frame_std = _expand_downsampled(coarse_std, downsample, frame_shape)
 
     flat_field = data.FlatField(combined_frame, pri_hdr=flat_dataset[0].pri_hdr.copy(),
                          ext_hdr=flat_dataset[0].ext_hdr.copy(), input_dataset=flat_dataset)
 
     #determine the standard error of the mean: stddev/sqrt(n_frames)
-    flat_field.err = np.nanstd(flat_dataset.all_data, axis=0)/np.sqrt(len(flat_dataset))
-    flat_field.err=flat_field.err.reshape((1,)+flat_field.err.shape) # Get it into the right dimension
+    # the err array has a leading layer dimension
+    flat_field.err = (frame_std/np.sqrt(len(flat_dataset)))[None, ...]
 
 
     return flat_field
 
+def _expand_downsampled(coarse, downsample, shape):
+    """
+    Expand an image downsampled by taking every downsample-th pixel back to its original shape,
+    by repeating each pixel into a downsample x downsample block.
+
+    Args:
+        coarse (np.array): 2D downsampled image
+        downsample (int): downsampling factor along each axis
+        shape (tuple): shape of the original image
+
+    Returns:
+        np.array: 2D image with the given shape
+    """
+    expanded = np.repeat(np.repeat(coarse, downsample, axis=0), downsample, axis=1)
+    return np.ascontiguousarray(expanded[:shape[0], :shape[1]])
+
 def get_relgains(frame, em_gain, non_lin_correction):
     """
     For a given bias subtracted frame of dn counts, return a same sized
@@ -65,17 +93,44 @@ def get_relgains(frame, em_gain, non_lin_correction):
     if non_lin_correction is None: # then no correction
         return np.ones_like(frame) 
     
+    table = np.asarray(non_lin_correction.data, dtype=float)
+    count_ax, relgain_curve = _build_relgain_curve(table.tobytes(), table.shape,
+                                                   float(em_gain))
+
+    # For each dn count, find the relative gain. np.interp uses the edge
+    # values for out of bounds values
+    return np.interp(frame, count_ax, relgain_curve)
+
+@functools.lru_cache(maxsize=64)
+def _build_relgain_curve(table_bytes, table_shape, em_gain):
+    """
+    Validate a non-linearity table and interpolate its relative gain curve
+    for a given EM gain. Cached, since pipelines call get_relgains many times
+    with the same table and a handful of EM gains. The table is passed in as
+    bytes so that the cache is keyed on its contents.
+
+    Args:
+        table_bytes (bytes): float64 non-linearity table data, as bytes
+        table_shape (tuple): shape of the non-linearity table
+        em_gain (float): Detector EM gain.
+
+    Returns:
+        tuple:
+            np.array: read-only dn count axis of the table
+            np.array: read-only relative gain at each dn count for em_gain
+    """
+    table = np.frombuffer(table_bytes, dtype=float).reshape(table_shape)
     # Column headers are gains, row headers are dn counts
-    gain_ax = non_lin_correction.data[0, 1:]
-    count_ax = non_lin_correction.data[1:, 0]
+    gain_ax = table[0, 1:]
+    count_ax = table[1:, 0]
     # Array is relative gain values at a given dn count and gain
-    relgains = non_lin_correction.data[1:, 1:]
+    relgains = table[1:, 1:]
 
     #MMB Note: This check is maybe better placed in the code that is saving the non-linearity correction file?
     # Check for increasing axes
-    if np.any(np.diff(gain_ax) <= 0):
+    if np.any(gain_ax[1:] <= gain_ax[:-1]):
         raise ValueError('Gain axis (column headers) must be increasing')
-    if np.any(np.diff(count_ax) <= 0):
+    if np.any(count_ax[1:] <= count_ax[:-1]):
         raise ValueError('Counts axis (row headers) must be increasing')
     # Check that curves (data in columns) contain or straddle 1.0
     if (np.min(relgains, axis=0) > 1).any() or \
@@ -83,27 +138,17 @@ def get_relgains(frame, em_gain, non_lin_correction):
         raise ValueError('Gain curves (array columns) must contain or '
                               'straddle a relative gain of 1.0')
 
-    # Create interpolation for em gain (x), counts (y), and relative gain (z).
-    # Note that this defaults to using the edge values as fill_value for
-    # out of bounds values (same as specified below in interp1d)
-    f = interpolate.RectBivariateSpline(gain_ax,
-                                    count_ax,
-                                    relgains.T,
-                                    kx=1,
-                                    ky=1,
-    )
-    # Get the relative gain curve for the given gain value
-    relgain_curve = f(em_gain, count_ax)[0]
-
-    # Create interpolation for dn counts (x) and relative gains (y). For
-    # out of bounds values use edge values
-    ff = interpolate.interp1d(count_ax, relgain_curve, kind='linear',
-                              bounds_error=False,
-                              fill_value=(relgain_curve[0], relgain_curve[-1]))
-    # For each dn count, find the relative gain
-    counts_flat = ff(frame.ravel())
-
-    return counts_flat.reshape(frame.shape)
+    # Linearly interpolate the relative gain curve for the given em gain
+    # between the two bracketing gain columns, using the edge columns for
+    # out of bounds values
+    i_gain = np.clip(np.searchsorted(gain_ax, em_gain, side='right') - 1,
+                     0, len(gain_ax) - 2)
+    w = (em_gain - gain_ax[i_gain]) / (gain_ax[i_gain+1] - gain_ax[i_gain])
+    w = np.clip(w, 0, 1)
+    relgain_curve = (1 - w)*relgains[:, i_gain] + w*relgains[:, i_gain+1]
+    relgain_curve.flags.writeable = False
+
+    return count_ax, relgain_curve
 
 detector_areas= {
     'SCI' : {
@@ -269,26 +314,95 @@ def slice_section(frame, obstype, key, detector_regions=None):
     Ported from II&T read_metadata.py
 
     Args:
-        frame (np.ndarray): Full frame consistent with size given in frame_rows, frame_cols
+        frame (np.ndarray): Full frame consistent with size given in frame_rows, frame_cols. Can have
+            leading dimensions (e.g., a 3D error array), in which case the last two axes are sliced.
         obstype (str): Keyword referencing the observation type (e.g. 'ENG' or 'SCI')
         key (str): Keyword referencing section to be sliced; must exist in detector_areas
         detector_regions (dict): a dictionary of detector geometry properties.  Keys should be as found in detector_areas in detector.py.  Defaults to that dictionary.
 
     Returns:
-        np.ndarray: a 2D array of the specified detector area
+        np.ndarray: a view of the specified detector area
     """
-    if detector_regions is None:
-            detector_regions = detector_areas
-    rows = detector_regions[obstype][key]['rows']
-    cols = detector_regions[obstype][key]['cols']
-    r0c0 = detector_regions[obstype][key]['r0c0']
+    row_slice, col_slice = section_slices(obstype, key, detector_regions)
 
-    section = frame[r0c0[0]:r0c0[0]+rows, r0c0[1]:r0c0[1]+cols]
+    section = frame[..., row_slice, col_slice]
     if section.size == 0:
-        raise Exception('Corners invalid. Tried to slice shape of {0} from {1} to {2} rows and {3} columns'.format(frame.shape, r0c0, rows, cols))
+        raise Exception('Corners invalid. Tried to slice shape of {0} from {1} to {2} rows and {3} columns'.format(
+            frame.shape, [row_slice.start, col_slice.start], row_slice.stop - row_slice.start, col_slice.stop - col_slice.start))
     return section
 
+def section_slices(obstype, key, detector_regions=None):
+    """
+    Row and column slices of a detector section, so the same section can be cut out of
+    several arrays (e.g., data, err, and dq) without looking up the geometry each time.
+
+    Args:
+        obstype (str): Keyword referencing the observation type (e.g. 'ENG' or 'SCI')
+        key (str): Keyword referencing section to be sliced; must exist in detector_areas
+        detector_regions (dict): a dictionary of detector geometry properties.  Keys should be as found in detector_areas in detector.py.  Defaults to that dictionary.
 
+    Returns:
+        tuple: row slice and column slice of the section
+    """
+    region = _get_region(obstype, key, detector_regions)
+    return region.row_slice, region.col_slice
+
+@dataclass(frozen=True)
+class _Region():
+    """
+    Geometry of one section of the detector, as found in detector_areas.
+
+    Attributes:
+        rows (int): number of rows of the section
+        cols (int): number of columns of the section
+        r0c0 (list): [row, col] of the corner closest to (0,0)
+        row_slice (slice): rows of the full frame covered by the section
+        col_slice (slice): columns of the full frame covered by the section
+    """
+    rows: int
+    cols: int
+    r0c0: list
+    row_slice: slice
+    col_slice: slice
+
+    @classmethod
+    def from_coords(cls, coords):
+        """
+        Build a region from one sub-dictionary of detector_areas.
+
+        Args:
+            coords (dict): section geometry, with 'rows', 'cols', and 'r0c0' keys
+
+        Returns:
+            _Region: the geometry of the section
+        """
+        rows = coords['rows']
+        cols = coords['cols']
+        r0c0 = coords['r0c0']
+        return cls(rows, cols, r0c0, slice(r0c0[0], r0c0[0]+rows), slice(r0c0[1], r0c0[1]+cols))
+
+# geometry of every section in detector_areas, keyed by (obstype, key), built once so the
+# default geometry can be looked up without walking the nested dictionary. Edits made to
+# detector_areas after import are not seen; pass a modified copy as detector_regions instead.
+_default_regions = {(obstype, key): _Region.from_coords(coords)
+                    for obstype, regions in detector_areas.items()
+                    for key, coords in regions.items() if isinstance(coords, dict)}
+
+def _get_region(obstype, key, detector_regions=None):
+    """
+    Geometry of a detector section, from the cache for the default detector_areas.
+
+    Args:
+        obstype (str): Keyword referencing the observation type (e.g. 'ENG' or 'SCI')
+        key (str): Keyword referencing the section
+        detector_regions (dict): a dictionary of detector geometry properties.  Defaults to detector_areas.
+
+    Returns:
+        _Region: the geometry of the section
+    """
+    if detector_regions is None or detector_regions is detector_areas:
+        return _default_regions[(obstype, key)]
+    return _Region.from_coords(detector_regions[obstype][key])
 
 def unpack_geom(obstype, key, detector_regions=None):
     """Safely check format of geom sub-dictionary and return values.
@@ -309,14 +423,8 @@ def unpack_geom(obstype, key, detector_regions=None):
         r0c0: tuple
         Tuple of (row position, column position) of corner closest to (0,0)
     """
-    if detector_regions is None:
-        detector_regions = detector_areas
-    coords = detector_regions[obstype][key]
-    rows = coords['rows']
-    cols = coords['cols']
-    r0c0 = coords['r0c0']
-
-    return rows, cols, r0c0
+    region = _get_region(obstype, key, detector_regions)
+    return region.rows, region.cols, region.r0c0
 
 def imaging_area_geom(obstype, detector_regions=None):
     """Return geometry of imaging area (including shielded pixels)
@@ -363,7 +471,7 @@ def imaging_slice(obstype, frame, detector_regions=None):
         obstype: str
         Keyword referencing the observation type (e.g. 'ENG' or 'SCI')
         frame: array_like
-        Input frame
+        Input frame. Can have leading dimensions (e.g., a 3D error array), in which case the last two axes are sliced.
         detector_regions: dict
         a dictionary of detector geometry properties.  Keys should be as found in detector_areas in detector.py.  Defaults to that dictionary.
 
@@ -373,11 +481,11 @@ def imaging_slice(obstype, frame, detector_regions=None):
 
     """
     rows, cols, r0c0 = imaging_area_geom(obstype, detector_regions)
-    sl = frame[r0c0[0]:r0c0[0]+rows, r0c0[1]:r0c0[1]+cols]
+    sl = frame[..., r0c0[0]:r0c0[0]+rows, r0c0[1]:r0c0[1]+cols]
     return sl
 
 def flag_cosmics(cube, fwc, sat_thresh, plat_thresh, cosm_filter, cosm_box,
-                   cosm_tail, mode='image'):
+                   cosm_tail, mode='image', out=None):
     """Identify and remove saturated cosmic ray hits and tails.
 
     Use sat_thresh (interval 0 to 1) to set the threshold above which cosmics
@@ -395,10 +503,11 @@ def flag_cosmics(cube, fwc, sat_thresh, plat_thresh, cosm_filter, cosm_box,
     Args:
         cube (array_like, float):
             3D cube of image data (bias of zero).
-        fwc (float):
+        fwc (float or array_like):
             Full well capacity of detector *in DNs*.  Note that this may require a
             conversion as FWCs are usually specified in electrons, but the image
-            is in DNs at this point.
+            is in DNs at this point. Can also be a 1D array with one value
+            per frame of cube.
         sat_thresh (float):
             Multiplication factor for fwc that determines saturated cosmic pixels.
         plat_thresh (float):
@@ -422,6 +531,10 @@ def flag_cosmics(cube, fwc, sat_thresh, plat_thresh, cosm_filter, cosm_box,
             If 'full', a full-frame input is assumed, and if the input tail length
             is longer than the length to the end of the full-frame row, the masking
             continues onto the next row.  Defaults to 'image'.
+        out (np.ndarray, optional):
+            Array with the same shape as cube to write the mask into, so it can
+            be reused across calls. It is zeroed first. If None, a new uint8
+            array is allocated.
 
     Returns:
         array_like, int:
@@ -442,49 +555,83 @@ def flag_cosmics(cube, fwc, sat_thresh, plat_thresh, cosm_filter, cosm_box,
     B Nemati and S Miller - UAH - 02-Oct-2018
 
     """
-    mask = np.zeros(cube.shape, dtype=int)
+    if out is None:
+        mask = np.zeros(cube.shape, dtype=np.uint8)
+    else:
+        if out.shape != cube.shape:
+            raise ValueError('out has shape {0} but cube has shape {1}'.format(out.shape, cube.shape))
+        out.fill(0)
+        mask = out
+    n_rows, n_cols = cube.shape[1:]
+
+    # full well capacity of each frame
+    frame_fwc = np.broadcast_to(np.asarray(fwc, dtype=float), cube.shape[:1])
 
     # Do a cheap prefilter for rows that don't have anything bright
-    max_rows = np.max(cube, axis=-1,keepdims=True)
-    ji_streak_rows = np.transpose(np.array((max_rows >= sat_thresh*fwc).nonzero()[:-1]))
-
-    for j,i in ji_streak_rows:
-        row = cube[j,i]
-
-        # Find if and where saturated plateaus start in streak row
-        i_begs = find_plateaus(row, fwc, sat_thresh, plat_thresh, cosm_filter)
-
-        # If plateaus exist, kill the hit and the tail
-        cutoffs = np.array([])
-        ex_l = np.array([])
-        if i_begs is not None:
-            for i_beg in i_begs:
-                # implement cosm_tail
-                if i_beg+cosm_filter+cosm_tail+1 > mask.shape[2]:
-                    ex_l = np.append(ex_l,
-                            i_beg+cosm_filter+cosm_tail+1-mask.shape[2])
-                    cutoffs = np.append(cutoffs, i+1)
-                streak_end = int(min(i_beg+cosm_filter+cosm_tail+1,
-                                mask.shape[2]))
-                mask[j, i, i_beg:streak_end] = 1
-                # implement cosm_box
-                st_row = max(i-cosm_box, 0)
-                end_row = min(i+cosm_box+1, mask.shape[1])
-                st_col = max(i_beg-cosm_box, 0)
-                end_col = min(i_beg+cosm_box+1, mask.shape[2])
-                mask[j, st_row:end_row, st_col:end_col] = 1
-                pass
-
-        if mode == 'full' and len(ex_l) > 0:
-            mask_rav = mask[j].ravel()
-            for k in range(len(ex_l)):
-                row = cutoffs[k]
-                rav_ind = int(row * mask.shape[2] - 1)
-                mask_rav[rav_ind:rav_ind + int(ex_l[k])] = 1
+    ji_streak_rows = np.argwhere(np.max(cube, axis=-1) >=
+                                 sat_thresh*frame_fwc[:, np.newaxis])
+    if len(ji_streak_rows) == 0:
+        return mask
 
+    # Find if and where saturated plateaus start in each streak row. The
+    # way median_filter works, it will find cosmics that are cosm_filter-1
+    # wide. Add 1 to cosm_filter to correct for this
+    row_fwc = frame_fwc[ji_streak_rows[:, 0]]
+    plateau_starts = kernels.streak_plateau_starts(cube, ji_streak_rows,
+                        cosm_filter+1, sat_thresh*row_fwc, plat_thresh*row_fwc)
+    k_hit, i_beg = plateau_starts.nonzero()
+    if len(k_hit) == 0:
+        return mask
+    j = ji_streak_rows[k_hit, 0]
+    i = ji_streak_rows[k_hit, 1]
+
+    # Kill the hit and the tail, as runs of indices into the flattened mask
+    # implement cosm_tail
+    tail_end = i_beg+cosm_filter+cosm_tail+1
+    row_start = (j*n_rows + i)*n_cols
+    starts = [row_start + i_beg]
+    stops = [row_start + np.minimum(tail_end, n_cols)]
+
+    # implement cosm_box, one run per row of each box
+    st_row = np.maximum(i-cosm_box, 0)
+    end_row = np.minimum(i+cosm_box+1, n_rows)
+    st_col = np.maximum(i_beg-cosm_box, 0)
+    end_col = np.minimum(i_beg+cosm_box+1, n_cols)
+    box_heights = end_row - st_row
+    box_row_start = (np.repeat(j, box_heights)*n_rows
+                     + _run_indices(st_row, end_row))*n_cols
+    starts.append(box_row_start + np.repeat(st_col, box_heights))
+    stops.append(box_row_start + np.repeat(end_col, box_heights))
+
+    if mode == 'full':
+        # continue tails that run past the end of the row onto the next row
+        overflow = tail_end > n_cols
+        frame_start = j[overflow]*n_rows*n_cols
+        ex_start = frame_start + (i[overflow]+1)*n_cols - 1
+        starts.append(ex_start)
+        stops.append(np.minimum(ex_start + tail_end[overflow] - n_cols,
+                                frame_start + n_rows*n_cols))
+
+    mask.reshape(-1)[_run_indices(np.concatenate(starts),
+                                  np.concatenate(stops))] = 1
 
     return mask
 
+def _run_indices(starts, stops):
+    """Concatenate the index ranges [starts[k], stops[k]) into one array.
+
+    Args:
+        starts (np.array): 1D int array of the first index of each run
+        stops (np.array): 1D int array of one past the last index of each run
+
+    Returns:
+        np.array: 1D int array of all indices in the runs, in order
+    """
+    lengths = np.maximum(stops - starts, 0)
+    # offset of each run's first element within the output
+    run_offsets = np.cumsum(lengths) - lengths
+    return np.repeat(starts - run_offsets, lengths) + np.arange(lengths.sum())
+
 def find_plateaus(streak_row, fwc, sat_thresh, plat_thresh, cosm_filter):
     """Find the beginning index of each cosmic plateau in a row.
 
@@ -506,22 +653,19 @@ def find_plateaus(streak_row, fwc, sat_thresh, plat_thresh, cosm_filter):
         array_like, int:
             Index of plateau beginnings, or None if there is no plateau.
     """
+    # The median can't exceed the row maximum, so skip the filter for rows
+    # with nothing bright enough
+    if np.max(streak_row) < sat_thresh*fwc:
+        return None
+
     # Lowpass filter row to differentiate plateaus from standalone pixels
     # The way median_filter works, it will find cosmics that are cosm_filter-1
     # wide. Add 1 to cosm_filter to correct for this
-    filtered = median_filter(streak_row, cosm_filter+1, mode='nearest')
+    filtered = kernels.rolling_median(streak_row, cosm_filter+1)
     saturated = (filtered >= sat_thresh*fwc).nonzero()[0]
 
     if len(saturated) > 0:
-        i_begs = np.array([])
-        for i in range(len(saturated)):
-            i_beg = saturated[i]
-            while i_beg > 0 and streak_row[i_beg] >= plat_thresh*fwc:
-                i_beg -= 1
-            # unless saturated at col 0, shifts forward 1 to plateau start
-            if streak_row[i_beg] < plat_thresh*fwc:
-                i_beg += 1
-            i_begs = np.append(i_begs, i_beg)
+        i_begs = kernels.plateau_starts(streak_row, saturated, plat_thresh*fwc)
 
         return np.unique(i_begs).astype(int)
     else:
@@ -542,8 +686,7 @@ def calc_sat_fwc(emgain_arr,fwcpp_arr,fwcem_arr,sat_thresh):
     Returns:
         np.array: lowest full well capacity saturation threshold for frames
     """
-	possible_sat_fwcs_arr = np.append((emgain_arr * fwcpp_arr)[:,np.newaxis], fwcem_arr[:,np.newaxis],axis=1)
-	sat_fwcs = sat_thresh * np.min(possible_sat_fwcs_arr,axis=1)
+	sat_fwcs = sat_thresh * np.minimum(emgain_arr * fwcpp_arr, fwcem_arr)
 
 	return sat_fwcs
 
@@ -1,10 +1,16 @@
 # A file that holds the functions that transmogrify l1 data to l2a data
-from corgidrp.detector import get_relgains, slice_section, detector_areas, flag_cosmics, calc_sat_fwc, imaging_slice, imaging_area_geom
+import os
+from concurrent.futures import ThreadPoolExecutor
+from corgidrp.detector import get_relgains, section_slices, detector_areas, flag_cosmics, calc_sat_fwc, imaging_area_geom
 import numpy as np
 import corgidrp.data as data
+import corgidrp._kernels as kernels
+
+# upper limit in bytes on the buffer of relative gains that correct_nonlinearity holds at a time
+nonlin_chunk_bytes = 256 * 1024**2
 
 def prescan_biassub(input_dataset, noise_maps=None, return_full_frame=False, 
-                    detector_regions=None, use_imaging_area = False):
+                    detector_regions=None, use_imaging_area = False, parallel=True, dtype=None):
     """
     Measure and subtract the median bias in each row of the pre-scan detector region.
     This step also crops the images to just the science area, or
@@ -19,6 +25,11 @@ def prescan_biassub(input_dataset, noise_maps=None, return_full_frame=False,
         detector_regions: (dict):  A dictionary of detector geometry properties.
             Keys should be as found in detector_areas in detector.py. Defaults to detector_areas in detector.py.
         use_imaging_area (bool): flag indicating whether to use the imaging area (like in the trap pump code) or use the defualt (equivalent to EMCCDFrame)
+        parallel (bool): bias subtract the frames concurrently using a thread pool. The numpy operations on each
+            frame release the GIL, so this is generally faster. Set to False to process them one at a time. Defaults to True.
+        dtype (np.dtype): (optional) floating point type to compute and store the bias subtracted data and errors in, e.g. np.float32,
+            which halves the size of the output cubes and the memory traffic of later steps at single precision.
+            Defaults to None, which keeps the precision of the input data and the measured bias (usually float64).
 
     Returns:
         corgidrp.data.Dataset: a pre-scan bias subtracted version of the input dataset
@@ -29,14 +40,17 @@ def prescan_biassub(input_dataset, noise_maps=None, return_full_frame=False,
     if detector_regions is None:
         detector_regions = detector_areas
 
-    # Initialize list of output frames to be concatenated
-    out_frames_data = []
-    out_frames_err = []
-    out_frames_dq = []
-    out_frames_bias = []
+    # Views of the image area of each frame, copied into the output arrays below
+    image_data_list = []
+    image_err_list = []
+    image_dq_list = []
 
-    # Place to save new error estimates to be added later via Image.add_error_term()
-    new_err_list = []
+    # Observation type and the reliable part of the aligned prescan of each frame
+    obstypes = []
+    al_prescans = []
+
+    # Slices of the prescan and image area, looked up once per observation type
+    geoms = {}
 
     # Iterate over frames
     for i, frame in enumerate(output_dataset):
@@ -52,86 +66,104 @@ def prescan_biassub(input_dataset, noise_maps=None, return_full_frame=False,
 
         if detector_regions[obstype]['frame_rows'] != frame_data.shape[0] or detector_regions[obstype]['frame_cols'] != frame_data.shape[1]:
             raise Exception('Frame size incompatible with specified detector_regions.')
-        # Get the reliable prescan area
-        prescan = slice_section(frame_data, obstype, 'prescan', detector_regions=detector_regions)
-
-        if not return_full_frame:
-            # Get the image area
-            if use_imaging_area: 
-                image_data = imaging_slice(obstype, frame_data, detector_regions=detector_regions)
-                image_dq = imaging_slice(obstype, frame_dq, detector_regions=detector_regions)
-
-                image_err = []
-                for err_slice in frame_err:
-                    image_err.append(imaging_slice(obstype, err_slice, detector_regions=detector_regions))
-                image_err = np.array(image_err)
-
-                prows, _, r0c0 = imaging_area_geom(obstype,detector_regions=detector_regions)
-                i_r0 = r0c0[0]
-                p_r0 = detector_regions[obstype]['prescan']['r0c0'][0]
-                al_prescan = prescan[(i_r0-p_r0):(i_r0-p_r0+prows), :]
-
-            else: 
-                image_data = slice_section(frame_data, obstype, 'image', detector_regions)
-                image_dq = slice_section(frame_dq, obstype, 'image', detector_regions)
-
-                # Special treatment for 3D error array
-                image_err = []
-                for err_slice in frame_err:
-                    image_err.append(slice_section(err_slice, obstype, 'image', detector_regions))
-                image_err = np.array(image_err)
-
-                # Get the part of the prescan that lines up with the image
-                i_r0 = detector_areas[obstype]['image']['r0c0'][0]
-                p_r0 = detector_areas[obstype]['prescan']['r0c0'][0]
-                i_nrow = detector_areas[obstype]['image']['rows']
-                al_prescan = prescan[(i_r0-p_r0):(i_r0-p_r0+i_nrow), :]
-
-        else:
-            # Use full frame
-            image_data = frame_data
-            image_dq = frame_dq
-
-            # Special treatment for 3D error array
-            image_err = []
-            for err_slice in frame_err:
-                image_err.append(err_slice)
-            image_err = np.array(image_err)
-
-            al_prescan = prescan
-
-        st = detector_regions[obstype]['prescan']['col_start']
-        end = detector_regions[obstype]['prescan']['col_end']
-
-        # Measure bias and error (standard error of the median for each row, add this to 3D image array)
-        medbyrow = np.median(al_prescan[:,st:end], axis=1)[:, np.newaxis]
-        sterrbyrow = np.std(al_prescan[:,st:end], axis=1)[:, np.newaxis] * np.ones_like(image_data) / np.sqrt(al_prescan[:,st:end].shape[1])
-        if noise_maps is not None:
-            bias_offset = noise_maps.bias_offset
-            bias_offset_err = noise_maps.bias_offset_err
-        else:
-            bias_offset = 0
-            bias_offset_err = 0
+
+        if obstype not in geoms:
+            geoms[obstype] = _prescan_biassub_slices(obstype, detector_regions, return_full_frame, use_imaging_area)
+        prescan_sl, image_sl, al_prescan_sl = geoms[obstype]
+
+        # Get the reliable part of the prescan that lines up with the image
+        prescan = frame_data[prescan_sl]
+        al_prescan = prescan[al_prescan_sl]
+
+        # Get the image area. The 3D error array is sliced along its last two axes
+        image_data = frame_data[image_sl]
+        image_dq = frame_dq[image_sl]
+        image_err = frame_err[(Ellipsis,) + image_sl]
+
+        obstypes.append(obstype)
+        al_prescans.append(al_prescan)
+        image_data_list.append(image_data)
+        image_err_list.append(image_err)
+        image_dq_list.append(image_dq)
+
+    # Measure bias and error (standard error of the median for each row) in one
+    # call for all frames that share a geometry
+    medbyrow_list = [None] * len(output_dataset)
+    stdbyrow_list = [None] * len(output_dataset)
+    for obstype in set(obstypes):
+        frame_inds = [i for i in range(len(obstypes)) if obstypes[i] == obstype]
+        stacked_prescans = np.stack([al_prescans[i] for i in frame_inds])
+        meds = kernels.median(stacked_prescans, axis=2)
+        stds = np.std(stacked_prescans, axis=2) / np.sqrt(stacked_prescans.shape[2])
+        for k, i in enumerate(frame_inds):
+            medbyrow_list[i] = meds[k][:, np.newaxis]
+            stdbyrow_list[i] = stds[k][:, np.newaxis]
+
+    if noise_maps is not None:
+        bias_offset = noise_maps.bias_offset
+        bias_offset_err = noise_maps.bias_offset_err
+    else:
+        bias_offset = 0
+        bias_offset_err = 0
+
+    if dtype is not None:
+        # cast the bias and its error once, so all of the per-frame math is done in the requested precision
+        medbyrow_list = [medbyrow.astype(dtype) for medbyrow in medbyrow_list]
+        stdbyrow_list = [stdbyrow.astype(dtype) for stdbyrow in stdbyrow_list]
+        bias_offset = np.asarray(bias_offset, dtype=dtype)
+        bias_offset_err = np.asarray(bias_offset_err, dtype=dtype)
+
+    # Preallocate the output arrays, all frames have the same image area shape
+    num_frames = len(output_dataset)
+    image_shape = image_data_list[0].shape
+    out_frames_err_arr = np.empty((num_frames, image_err_list[0].shape[0]) + image_shape,
+                                  dtype=image_err_list[0].dtype if dtype is None else dtype)
+    out_frames_dq_arr = np.empty((num_frames,) + image_shape, dtype=image_dq_list[0].dtype)
+    out_frames_bias_arr = np.empty((num_frames, image_shape[0]), dtype=np.float32)
+    # dtypes depend on the measured bias, so these are allocated with the first frame
+    out_frames_data_arr = None
+    # Place to save new error estimates to be added later via Image.add_error_term()
+    new_err_arr = None
+
+    def process_frame(i):
+        # bias subtract frame i and copy it into the output arrays. Each frame writes its own slice.
+        image_data = image_data_list[i]
+        if dtype is not None:
+            image_data = image_data.astype(dtype, copy=False)
+
+        # add the error to the 3D image array
+        sterrbyrow = stdbyrow_list[i] * np.ones_like(image_data)
         sterrbyrow = np.sqrt(sterrbyrow**2 + bias_offset_err**2)
-        new_err_list.append(sterrbyrow)
 
-        bias = medbyrow - bias_offset
+        bias = medbyrow_list[i] - bias_offset
         image_bias_corrected = image_data - bias
 
-        out_frames_data.append(image_bias_corrected)
-        out_frames_err.append(image_err)
-        out_frames_dq.append(image_dq)
-        out_frames_bias.append(bias[:,0]) # save 1D version of array
-
+        nonlocal out_frames_data_arr, new_err_arr
+        if out_frames_data_arr is None:
+            out_frames_data_arr = np.empty((num_frames,) + image_shape, dtype=image_bias_corrected.dtype)
+            new_err_arr = np.empty((num_frames,) + image_shape, dtype=sterrbyrow.dtype)
+        out_frames_data_arr[i] = image_bias_corrected
+        new_err_arr[i] = sterrbyrow
+        out_frames_err_arr[i] = image_err_list[i]
+        out_frames_dq_arr[i] = image_dq_list[i]
+        out_frames_bias_arr[i] = bias[:,0] # save 1D version of array
+
+    # the first frame is done on its own since it allocates the output arrays
+    process_frame(0)
+    if parallel and num_frames > 1:
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            # consume the iterator so that any exceptions get raised here
+            list(executor.map(process_frame, range(1, num_frames)))
+    else:
+        for i in range(1, num_frames):
+            process_frame(i)
+
+    for frame in output_dataset:
         # Update header with new frame dimensions
-        frame.ext_hdr['NAXIS1'] = image_bias_corrected.shape[1]
-        frame.ext_hdr['NAXIS2'] = image_bias_corrected.shape[0]
+        frame.ext_hdr['NAXIS1'] = image_shape[1]
+        frame.ext_hdr['NAXIS2'] = image_shape[0]
 
     # Update all_data and reassign frame pointers (only necessary because the array size has changed)
-    out_frames_data_arr = np.array(out_frames_data)
-    out_frames_err_arr = np.array(out_frames_err)
-    out_frames_dq_arr = np.array(out_frames_dq)
-    out_frames_bias_arr = np.array(out_frames_bias, dtype=np.float32)
 
     output_dataset.all_data = out_frames_data_arr
     output_dataset.all_err = out_frames_err_arr
@@ -145,7 +177,7 @@ def prescan_biassub(input_dataset, noise_maps=None, return_full_frame=False,
         frame.add_extension_hdu("BIAS",data=out_frames_bias_arr[i])
 
     # Add new error component from this step to each frame using the Dataset class method
-    output_dataset.add_error_term(np.array(new_err_list),"prescan_bias_sub")
+    output_dataset.add_error_term(new_err_arr,"prescan_bias_sub")
 
     history_msg = "Frames cropped and bias subtracted" if not return_full_frame else "Bias subtracted"
 
@@ -154,6 +186,45 @@ def prescan_biassub(input_dataset, noise_maps=None, return_full_frame=False,
 
     return output_dataset
 
+def _prescan_biassub_slices(obstype, detector_regions, return_full_frame, use_imaging_area):
+    """
+    Slices used by prescan_biassub for one observation type.
+
+    Args:
+        obstype (str): Keyword referencing the observation type (e.g. 'ENG' or 'SCI')
+        detector_regions (dict): a dictionary of detector geometry properties
+        return_full_frame (bool): whether the full frame is returned instead of the image area
+        use_imaging_area (bool): whether to use the imaging area instead of the image area
+
+    Returns:
+        tuple: row and column slices of the prescan in the frame, row and column slices of
+            the output image in the frame, and row and column slices of the reliable prescan
+            region that lines up with the output image within the prescan
+    """
+    prescan_sl = section_slices(obstype, 'prescan', detector_regions)
+    p_r0 = detector_regions[obstype]['prescan']['r0c0'][0]
+
+    if return_full_frame:
+        # Use full frame
+        image_sl = (slice(None), slice(None))
+        al_rows = slice(None)
+    elif use_imaging_area:
+        i_nrow, i_ncol, r0c0 = imaging_area_geom(obstype, detector_regions=detector_regions)
+        image_sl = (slice(r0c0[0], r0c0[0]+i_nrow), slice(r0c0[1], r0c0[1]+i_ncol))
+        al_rows = slice(r0c0[0]-p_r0, r0c0[0]-p_r0+i_nrow)
+    else:
+        image_sl = section_slices(obstype, 'image', detector_regions)
+        # Get the part of the prescan that lines up with the image
+        i_r0 = detector_areas[obstype]['image']['r0c0'][0]
+        p_r0 = detector_areas[obstype]['prescan']['r0c0'][0]
+        i_nrow = detector_areas[obstype]['image']['rows']
+        al_rows = slice(i_r0-p_r0, i_r0-p_r0+i_nrow)
+
+    st = detector_regions[obstype]['prescan']['col_start']
+    end = detector_regions[obstype]['prescan']['col_end']
+
+    return prescan_sl, image_sl, (al_rows, slice(st, end))
+
 def detect_cosmic_rays(input_dataset, detector_params, sat_thresh=0.7,
                        plat_thresh=0.7, cosm_filter=1, cosm_box=3, cosm_tail=10,
                        mode='image'):
@@ -161,7 +232,9 @@ def detect_cosmic_rays(input_dataset, detector_params, sat_thresh=0.7,
     Detects cosmic rays in a given dataset. Updates the DQ to reflect the pixels that are affected.
     TODO: (Eventually) Decide if we want to invest time in improving CR rejection (modeling and subtracting the hit
     and tail rather than just flagging the whole row.)
-    TODO: Decode incoming DQ mask to avoid double counting saturation/CR flags in case a similar custom step has been run beforehand.
+
+    The new flags are combined with the incoming DQ mask with a bitwise OR, so
+    running this step twice does not double count saturation/CR flags.
 
     Args:
         input_dataset (corgidrp.data.Dataset): a dataset of Images that need cosmic ray identification (L1-level)
@@ -207,9 +280,19 @@ def detect_cosmic_rays(input_dataset, detector_params, sat_thresh=0.7,
 
 
     # Calculate the full well capacity for every frame in the dataset
-    kgain = np.array([detector_params.params['kgain'] for frame in crmasked_dataset])
-    emgain_list = []
-    for frame in crmasked_dataset:
+    # detector parameters are the same for every frame, so only look them up once
+    num_frames = len(crmasked_dataset)
+    kgain = detector_params.params['kgain']
+    fwcpp_e = detector_params.params['fwc_pp']
+    fwcem_e = detector_params.params['fwc_em']
+    fwcpp_dn = fwcpp_e / kgain
+    fwcem_dn = fwcem_e / kgain
+    fwcem_dn_arr = np.full(num_frames, fwcem_dn)
+
+    # pick the FWC that will get saturated first, depending on gain
+    # each frame header is read and updated in a single pass
+    sat_fwcs = np.empty(num_frames)
+    for i,frame in enumerate(crmasked_dataset):
         try: # use measured gain if available TODO change hdr name if necessary
             emgain = frame.ext_hdr['EMGAIN_M']
         except:
@@ -217,55 +300,42 @@ def detect_cosmic_rays(input_dataset, detector_params, sat_thresh=0.7,
                 emgain = frame.ext_hdr['EMGAIN_A']
             except: # otherwise use commanded EM gain
                 emgain = frame.ext_hdr['CMDGAIN']
-        emgain_list.append(emgain)
-    emgain_arr = np.array(emgain_list)
-    fwcpp_e_arr = np.array([detector_params.params['fwc_pp'] for frame in crmasked_dataset])
-    fwcem_e_arr = np.array([detector_params.params['fwc_em'] for frame in crmasked_dataset])
+        sat_fwcs[i] = calc_sat_fwc(emgain,fwcpp_dn,fwcem_dn,sat_thresh)
 
-    fwcpp_dn_arr = fwcpp_e_arr / kgain
-    fwcem_dn_arr = fwcem_e_arr / kgain
-
-    # pick the FWC that will get saturated first, depending on gain
-    sat_fwcs = calc_sat_fwc(emgain_arr,fwcpp_dn_arr,fwcem_dn_arr,sat_thresh)
-
-    for i,frame in enumerate(crmasked_dataset):
-        frame.ext_hdr['FWC_PP_E'] = fwcpp_e_arr[i]
-        frame.ext_hdr['FWC_EM_E'] = fwcem_e_arr[i]
+        frame.ext_hdr['FWC_PP_E'] = fwcpp_e
+        frame.ext_hdr['FWC_EM_E'] = fwcem_e
         frame.ext_hdr['SAT_DN'] = sat_fwcs[i]
 
-    sat_fwcs_array = np.array([np.full_like(crmasked_cube[0],sat_fwcs[i]) for i in range(len(sat_fwcs))])
-
     # threshold the frame to catch any values above sat_fwc --> this is
     # mask 1
-    m1 = (crmasked_cube >= sat_fwcs_array) * sat_dqval
+    m1 = crmasked_cube >= sat_fwcs[:, np.newaxis, np.newaxis]
 
     # run remove_cosmics() with fwc=fwc_em since tails only come from
     # saturation in the gain register --> this is mask 2
-    # Do a for loop since it's calling a for loop in the sub-routine anyway
-    # and can't handle different 'FWC_EM's for different frames.
-    m2 = np.zeros_like(crmasked_cube)
-
-    for i in range(len(crmasked_cube)):
-        m2[i,:,:] = flag_cosmics(cube=crmasked_cube[i:i+1,:,:],
-                        fwc=fwcem_dn_arr[i],
-                        sat_thresh=sat_thresh,
-                        plat_thresh=plat_thresh,
-                        cosm_filter=cosm_filter,
-                        cosm_box=cosm_box,
-                        cosm_tail=cosm_tail,
-                        mode=mode
-                        ) * cr_dqval
+    # All frames are searched at once, each with its own 'FWC_EM'.
+    m2 = flag_cosmics(cube=crmasked_cube,
+                      fwc=fwcem_dn_arr,
+                      sat_thresh=sat_thresh,
+                      plat_thresh=plat_thresh,
+                      cosm_filter=cosm_filter,
+                      cosm_box=cosm_box,
+                      cosm_tail=cosm_tail,
+                      mode=mode
+                      )
 
     # add the two masks to the all_dq mask
-    new_all_dq = np.bitwise_or(crmasked_dataset.all_dq, m1)
-    new_all_dq =  np.bitwise_or(new_all_dq, m2.astype(int))
+    # the masks stay one byte per pixel; each DQ value is OR'd into all_dq in place where its
+    # mask is set, so no full-size DQ cube is allocated and any DQ bit value can be flagged
+    all_dq = crmasked_dataset.all_dq
+    np.bitwise_or(all_dq, all_dq.dtype.type(sat_dqval), out=all_dq, where=m1)
+    np.bitwise_or(all_dq, all_dq.dtype.type(cr_dqval), out=all_dq, where=m2.view(bool))
 
     history_msg = ("Cosmic ray mask created. "
                    "Used detector parameters from {0}"
                    "with hash {1}").format(detector_params.filename, detector_params.get_hash())
 
     # update the output dataset with this new dark subtracted data and update the history
-    crmasked_dataset.update_after_processing_step(history_msg, new_all_dq=new_all_dq)
+    crmasked_dataset.update_after_processing_step(history_msg)
 
     return crmasked_dataset
 
@@ -289,6 +359,7 @@ def correct_nonlinearity(input_dataset, non_lin_correction):
     if "CMDGAIN" not in linearized_dataset[0].ext_hdr.keys():
         raise ValueError("EM gain not found in header of input dataset. Non-linearity correction requires EM gain to be in header.")
 
+    em_gains = []
     for i in range(linearized_cube.shape[0]):
         try: # use measured gain if available TODO change hdr name if necessary
             em_gain = linearized_dataset[i].ext_hdr["EMGAIN_M"]
@@ -297,8 +368,21 @@ def correct_nonlinearity(input_dataset, non_lin_correction):
                 em_gain = linearized_dataset[i].ext_hdr["EMGAIN_A"]
             except: # otherwise use commanded EM gain
                 em_gain = linearized_dataset[i].ext_hdr["CMDGAIN"]
-        linearized_cube[i] *= get_relgains(linearized_cube[i], em_gain, non_lin_correction)
-    
+        em_gains.append(em_gain)
+    em_gains = np.array(em_gains)
+
+    # correct each run of consecutive frames with the same EM gain with one call, in chunks of
+    # frames small enough that the (float64) relative gain buffer stays under nonlin_chunk_bytes
+    frame_bytes = max(1, linearized_cube[0].size * np.dtype(np.float64).itemsize)
+    chunk_frames = max(1, nonlin_chunk_bytes // frame_bytes)
+    run_starts = np.flatnonzero(np.r_[True, em_gains[1:] != em_gains[:-1]])
+    run_ends = np.r_[run_starts[1:], len(em_gains)]
+    for run_start, run_end in zip(run_starts, run_ends):
+        em_gain = em_gains[run_start]
+        for chunk_start in range(run_start, run_end, chunk_frames):
+            chunk = linearized_cube[chunk_start:min(chunk_start + chunk_frames, run_end)]
+            chunk *= get_relgains(chunk, em_gain, non_lin_correction)
+
     if non_lin_correction is not None:
         history_msg = "Data corrected for non-linearity with {0}".format(non_lin_correction.filename)
 
@@ -306,7 +390,7 @@ def correct_nonlinearity(input_dataset, non_lin_correction):
 
     return linearized_dataset
 
-def update_to_l2a(input_dataset):
+def update_to_l2a(input_dataset, inplace=False):
     """
     Updates the data level to L2a. Only works on L1 data.
 
@@ -314,6 +398,8 @@ def update_to_l2a(input_dataset):
 
     Args:
         input_dataset (corgidrp.data.Dataset): a dataset of Images (L1-level)
+        inplace (bool): if True, update the headers of input_dataset directly instead of
+            updating a copy. Only use this if the L1 input dataset is not needed afterwards. Defaults to False.
 
     Returns:
         corgidrp.data.Dataset: same dataset now at L2-level
@@ -325,7 +411,10 @@ def update_to_l2a(input_dataset):
             raise ValueError(err_msg)
 
     # we aren't altering the data
-    updated_dataset = input_dataset.copy(copy_data=False)
+    if inplace:
+        updated_dataset = input_dataset
+    else:
+        updated_dataset = input_dataset.copy(copy_data=False)
 
     for frame in updated_dataset:
         # update header
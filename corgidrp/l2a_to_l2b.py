@@ -17,25 +17,15 @@ def add_photon_noise(input_dataset):
     # you should make a copy the dataset to start
     phot_noise_dataset = input_dataset.copy() # necessary at all?
 
-    for i, frame in enumerate(phot_noise_dataset.frames):
-        try: # use measured gain if available TODO change hdr name if necessary
-            em_gain = phot_noise_dataset[i].ext_hdr["EMGAIN_M"]
-        except:
-            try: # use EM applied EM gain if available
-                em_gain = phot_noise_dataset[i].ext_hdr["EMGAIN_A"]
-            except: # otherwise use commanded EM gain
-                em_gain = phot_noise_dataset[i].ext_hdr["CMDGAIN"]
-        phot_err = np.sqrt(frame.data)
-        #add excess noise in case of em_gain
-        if em_gain > 1:
-            phot_err *= np.sqrt(2)           
-        frame.add_error_term(phot_err, "photnoise_error")
-    
-    new_all_err = np.array([frame.err for frame in phot_noise_dataset.frames])        
-    
+    em_gains = np.array([_get_em_gain(frame.ext_hdr) for frame in phot_noise_dataset.frames])
+    phot_err = np.sqrt(phot_noise_dataset.all_data)
+    #add excess noise in case of em_gain
+    phot_err[em_gains > 1] *= np.sqrt(2)
+    phot_noise_dataset.add_error_term(phot_err, "photnoise_error")
+
     history_msg = "photon noise propagated to error map"
     # update the output dataset
-    phot_noise_dataset.update_after_processing_step(history_msg, new_all_err = new_all_err)
+    phot_noise_dataset.update_after_processing_step(history_msg)
 
     return phot_noise_dataset
 
@@ -88,7 +78,9 @@ def dark_subtraction(input_dataset, dark, detector_regions=None, outputdir=None)
     else:
         raise Exception('dark type should be either corgidrp.data.Dark or corgidrp.data.DetectorNoiseMaps.')
 
-    darksub_cube = darksub_dataset.all_data - dark.data
+    # darksub_dataset is already a copy, so subtract in place. Unsafe casting matches
+    # what assigning a float result back into all_data would do for integer data
+    np.subtract(darksub_dataset.all_data, dark.data, out=darksub_dataset.all_data, casting='unsafe')
 
     # propagate the error of the dark frame
     if hasattr(dark, "err"):
@@ -105,7 +97,7 @@ def dark_subtraction(input_dataset, dark, detector_regions=None, outputdir=None)
     history_msg = "Dark subtracted using dark {0}.  Units changed from detected electrons to photoelectrons.".format(dark.filename)
 
     # update the output dataset with this new dark subtracted data and update the history
-    darksub_dataset.update_after_processing_step(history_msg, new_all_data=darksub_cube, new_all_dq = new_all_dq, header_entries = {"BUNIT":"photoelectrons"})
+    darksub_dataset.update_after_processing_step(history_msg, new_all_dq = new_all_dq, header_entries = {"BUNIT":"photoelectrons"})
 
     return darksub_dataset
 
@@ -161,18 +153,22 @@ def frame_select(input_dataset, bpix_frac=1., allowed_bpix=0, overexp=False, tt_
     Returns:
         corgidrp.data.Dataset: a version of the input dataset with only the frames we want to use
     """
-    pruned_dataset = input_dataset.copy()
     reject_flags = np.zeros(len(input_dataset))
     reject_reasons = {}
 
     disallowed_bits = np.invert(allowed_bpix) # invert the mask
 
-    for i, frame in enumerate(pruned_dataset.frames):
+    if bpix_frac < 1:
+        # fraction of bad pixels in each frame
+        masked_dq = np.bitwise_and(input_dataset.all_dq, disallowed_bits) # handle allowed_bpix values
+        masked_dq = masked_dq.reshape((len(input_dataset), -1))
+        badpix_fracs = np.count_nonzero(masked_dq > 0, axis=1) / masked_dq.shape[1]
+
+    # only read from the input frames here, the frames we keep get copied below
+    for i, frame in enumerate(input_dataset.frames):
         reject_reasons[i] = [] # list of rejection reasons
         if bpix_frac < 1:
-            masked_dq = np.bitwise_and(frame.dq, disallowed_bits) # handle allowed_bpix values
-            numbadpix = np.size(np.where(masked_dq > 0)[0])
-            frame_badpix_frac = numbadpix / np.size(masked_dq)
+            frame_badpix_frac = badpix_fracs[i]
             # if fraction of bad pixel over threshold, mark is as bad
             if frame_badpix_frac > bpix_frac:
                 reject_flags[i] += 1
@@ -200,25 +196,25 @@ def frame_select(input_dataset, bpix_frac=1., allowed_bpix=0, overexp=False, tt_
                 reject_flags[i] += 32 # use distinct bits in case it's useful
                 reject_reasons[i].append("tilt rms {0:.1f} > {1:.1f}"
                                          .format(frame.ext_hdr['RESZ3'], tt_bias_thres))
-                
-        # if rejected, mark as bad in the header
-        if reject_flags[i] > 0:
-            frame.ext_hdr['IS_BAD'] = True
-                                
+
     good_frames = np.where(reject_flags == 0)
     bad_frames = np.where(reject_flags > 0)
     # check that we didn't remove all of the good frames
     if np.size(good_frames) == 0:
         raise ValueError("No good frames were selected. Unable to continue")
 
-    # if we need to discard bad, do that here. 
+    # if we need to discard bad, do that here, so that only the frames we keep are copied
     if discard_bad:
-        pruned_frames = pruned_dataset.frames[good_frames]
-        pruned_dataset = data.Dataset(pruned_frames)
-        
+        pruned_dataset = data.Dataset([input_dataset.frames[i].copy() for i in good_frames[0]])
+
         # history message of which frames were removed and why
         history_msg = "Removed {0} frames as bad:".format(np.size(bad_frames))
     else:
+        pruned_dataset = input_dataset.copy()
+        # if rejected, mark as bad in the header
+        for bad_index in bad_frames[0]:
+            pruned_dataset.frames[bad_index].ext_hdr['IS_BAD'] = True
+
         # history message of which frames were marked and why
         history_msg = "Marked {0} frames as bad:".format(np.size(bad_frames))
 
@@ -251,13 +247,14 @@ def convert_to_electrons(input_dataset, k_gain):
     kgain_error = kgain_dataset.all_err
 
     kgain = k_gain.value #extract from caldb
-    kgain_cube *= kgain
-    kgain_error *= kgain
+    # scale in the cube's own precision so float32 data is not processed in float64
+    kgain_cube *= _in_cube_precision(kgain, kgain_cube)
+    kgain_error *= _in_cube_precision(kgain, kgain_error)
 
     history_msg = "data converted to detected EM electrons by kgain {0}".format(str(kgain))
 
     # update the output dataset with this converted data and update the history
-    kgain_dataset.update_after_processing_step(history_msg, new_all_data=kgain_cube, new_all_err=kgain_error, header_entries = {"BUNIT":"detected EM electrons", "KGAIN":kgain})
+    kgain_dataset.update_after_processing_step(history_msg, new_all_err=kgain_error, header_entries = {"BUNIT":"detected EM electrons", "KGAIN":kgain})
     return kgain_dataset
 
 def em_gain_division(input_dataset):
@@ -278,28 +275,104 @@ def em_gain_division(input_dataset):
     emgain_cube = emgain_dataset.all_data
     emgain_error = emgain_dataset.all_err
 
-    for i in range(len(emgain_dataset)):
-        try: # use measured gain if available TODO change hdr name if necessary
-            emgain = emgain_dataset[i].ext_hdr["EMGAIN_M"]
-        except:
-            try: # use EM applied EM gain if available
-                emgain = emgain_dataset[i].ext_hdr["EMGAIN_A"]
-            except: # otherwise use commanded EM gain
-                emgain = emgain_dataset[i].ext_hdr["CMDGAIN"]
-        emgain_cube[i] /= emgain
-        emgain_error[i] /= emgain
-
-    dataset_list, _ = emgain_dataset.split_dataset(exthdr_keywords=['CMDGAIN'])
-    if len(dataset_list) > 1:
-        history_msg = "data divided by EM gain for dataset with frames with different commanded EM gains"
-    else:
-        history_msg = "data divided by EM gain for dataset with frames with the same commanded EM gain"
+    emgains = np.array([_get_em_gain(frame.ext_hdr) for frame in emgain_dataset])
+    emgain_cube /= _in_cube_precision(emgains, emgain_cube).reshape((-1,) + (1,) * (emgain_cube.ndim - 1))
+    emgain_error /= _in_cube_precision(emgains, emgain_error).reshape((-1,) + (1,) * (emgain_error.ndim - 1))
+
+    history_msg = _em_gain_history(emgain_dataset)
 
     # update the output dataset with this EM gain divided data and update the history
-    emgain_dataset.update_after_processing_step(history_msg, new_all_data=emgain_cube, new_all_err=emgain_error, header_entries = {"BUNIT":"detected electrons"})
+    emgain_dataset.update_after_processing_step(history_msg, new_all_err=emgain_error, header_entries = {"BUNIT":"detected electrons"})
 
     return emgain_dataset
 
+def convert_to_electrons_and_em_gain_division(input_dataset, k_gain):
+    """
+
+    Convert the data from ADU to detected electrons in one step. Equivalent to running
+    convert_to_electrons followed by em_gain_division, but the data and errors are only
+    scaled once, by k gain / EM gain for each frame.
+
+    Args:
+        input_dataset (corgidrp.data.Dataset): a dataset of Images (L2a-level)
+        k_gain (corgidrp.data.KGain): KGain calibration file
+
+    Returns:
+        corgidrp.data.Dataset: a version of the input dataset with the data in units "detected electrons"
+    """
+    # you should make a copy the dataset to start
+    electrons_dataset = input_dataset.copy()
+    electrons_cube = electrons_dataset.all_data
+    electrons_error = electrons_dataset.all_err
+
+    kgain = k_gain.value #extract from caldb
+    emgains = np.array([_get_em_gain(frame.ext_hdr) for frame in electrons_dataset])
+    scale = kgain / emgains
+    electrons_cube *= _in_cube_precision(scale, electrons_cube).reshape((-1,) + (1,) * (electrons_cube.ndim - 1))
+    electrons_error *= _in_cube_precision(scale, electrons_error).reshape((-1,) + (1,) * (electrons_error.ndim - 1))
+
+    history_msg = "data converted to detected EM electrons by kgain {0}; {1}".format(str(kgain), _em_gain_history(electrons_dataset))
+
+    # update the output dataset with this converted data and update the history
+    electrons_dataset.update_after_processing_step(history_msg, new_all_err=electrons_error, header_entries = {"BUNIT":"detected electrons", "KGAIN":kgain})
+
+    return electrons_dataset
+
+def _in_cube_precision(factor, cube):
+    """
+    Cast a scale factor to the precision of a floating point cube, so that e.g. float32
+    data is not scaled in float64. Factors for non-floating point cubes are left as they
+    are, so that scaling an integer cube in place still raises a casting error instead
+    of silently truncating the factor.
+
+    Args:
+        factor (float or np.ndarray): scale factor(s)
+        cube (np.ndarray): cube that will be scaled in place
+
+    Returns:
+        np.ndarray: the scale factor(s)
+    """
+    factor = np.asarray(factor)
+    if np.issubdtype(cube.dtype, np.floating):
+        factor = factor.astype(cube.dtype)
+    return factor
+
+def _get_em_gain(ext_hdr):
+    """
+    EM gain of a frame: the measured gain if available, otherwise the applied gain,
+    otherwise the commanded gain.
+
+    Args:
+        ext_hdr (astropy.io.fits.Header): extension header of the frame
+
+    Returns:
+        float: EM gain
+    """
+    try: # use measured gain if available TODO change hdr name if necessary
+        emgain = ext_hdr["EMGAIN_M"]
+    except:
+        try: # use EM applied EM gain if available
+            emgain = ext_hdr["EMGAIN_A"]
+        except: # otherwise use commanded EM gain
+            emgain = ext_hdr["CMDGAIN"]
+    return emgain
+
+def _em_gain_history(dataset):
+    """
+    History message for dividing a dataset by the EM gain
+
+    Args:
+        dataset (corgidrp.data.Dataset): dataset that was divided by the EM gain
+
+    Returns:
+        str: history message
+    """
+    cmdgains = set(frame.ext_hdr['CMDGAIN'] for frame in dataset)
+    if len(cmdgains) > 1:
+        return "data divided by EM gain for dataset with frames with different commanded EM gains"
+    else:
+        return "data divided by EM gain for dataset with frames with the same commanded EM gain"
+
 def cti_correction(input_dataset, pump_trap_cal):
     """
 
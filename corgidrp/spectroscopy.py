@@ -1,6 +1,7 @@
 import numpy as np
 import os
 import corgidrp.data
+import corgidrp._kernels as kernels
 from dataclasses import dataclass
 from astropy.table import Table
 from scipy.interpolate import interp1d
@@ -231,13 +232,16 @@ def gaussfit2d_pix(frame, xguess, yguess, xfwhm_guess=3, yfwhm_guess=6,
     oversampled_xcoord = np.linspace(-(oversample // 2) / oversample, 
                                      ncols - 1 + (oversample // 2) / oversample + 1./oversample,
                                      ncols * oversample)
-    oversampled_grid = np.meshgrid(oversampled_ycoord, oversampled_xcoord, indexing='ij')
-    
+    # the Gaussian is separable, so the pixel-integrated model is the outer product of the
+    # binned 1-d profiles along each axis rather than a binned oversampled 2-d grid
+    def binned_model(p):
+        x0, y0, sigma_x, sigma_y, peak = p
+        yprofile = np.exp(-((oversampled_ycoord - y0) / sigma_y) ** 2 / 2).reshape(nrows, oversample).mean(axis = 1)
+        xprofile = np.exp(-((oversampled_xcoord - x0) / sigma_x) ** 2 / 2).reshape(ncols, oversample).mean(axis = 1)
+        return peak * np.outer(yprofile, xprofile)
+
     if refinefit:
-        errorfunction = lambda p: np.ravel(
-                np.reshape(gauss2d(*p)(*oversampled_grid), 
-                (nrows, oversample, ncols, oversample)).mean(
-                axis = 1).mean(axis = 2) - fitbox)
+        errorfunction = lambda p: np.ravel(binned_model(p) - fitbox)
   
         guess = (halfwidth, halfheight, 
                  xfwhm_guess/(2 * np.sqrt(2*np.log(2))),
@@ -252,14 +256,10 @@ def gaussfit2d_pix(frame, xguess, yguess, xfwhm_guess=3, yfwhm_guess=6,
         yfwhm = p[3] * (2 * np.sqrt(2*np.log(2)))
         peakflux = p[4]
 
-        model = np.reshape(gauss2d(*p)(*oversampled_grid), 
-                        (nrows, oversample, ncols, oversample)).mean(
-                        axis = 1).mean(axis = 2)
+        model = binned_model(p)
         residual = fitbox - model
     else:
-        model = np.reshape(gauss2d(*guess)(*oversampled_grid), 
-                        (nrows, oversample, ncols, oversample)).mean(
-                        axis = 1).mean(axis = 2)
+        model = binned_model(guess)
         residual = fitbox - model
 
         xfit = xfit
@@ -507,8 +507,7 @@ def psf_registration_costfunc(p, template, data):
     xshift = p[0]
     yshift = p[1]
     amp = p[2]
-    shifted_template = amp * ndi.shift(template, (yshift, xshift), order=1, prefilter=False)
-    return np.sum((data - shifted_template)**2)
+    return kernels.shifted_template_ssd(template, data, xshift, yshift, amp)
 
 def fit_psf_centroid(psf_data, psf_template,
                      xcent_template = None, ycent_template = None,
@@ -569,8 +568,9 @@ def fit_psf_centroid(psf_data, psf_template,
     xmin_data_cut, xmax_data_cut = (int(xcom_data) - halfwidth, int(xcom_data) + halfwidth)
     ymin_data_cut, ymax_data_cut = (int(ycom_data) - halfheight, int(ycom_data) + halfheight) 
     
-    template_stamp = psf_template[ymin_template_cut:ymax_template_cut+1, xmin_template_cut:xmax_template_cut+1]
-    data_stamp = psf_data[ymin_data_cut:ymax_data_cut+1, xmin_data_cut:xmax_data_cut+1]
+    # the stamps are made contiguous and native byte order once, rather than in every cost function evaluation
+    template_stamp = np.ascontiguousarray(psf_template[ymin_template_cut:ymax_template_cut+1, xmin_template_cut:xmax_template_cut+1], dtype=float)
+    data_stamp = np.ascontiguousarray(psf_data[ymin_data_cut:ymax_data_cut+1, xmin_data_cut:xmax_data_cut+1], dtype=float)
     
     xoffset_guess, yoffset_guess = (0.0, 0.0)
     amp_guess = np.sum(psf_data) / np.sum(psf_template)
@@ -604,6 +604,40 @@ def fit_psf_centroid(psf_data, psf_template,
 
     return xfit, yfit, gauss2d_xfit, gauss2d_yfit, psf_peakpix_snr, x_precis, y_precis
 
+def weighted_polyfit(x, y, w, deg=3):
+    """ 
+    Weighted least-squares polynomial fit with a scaled covariance matrix.
+    Equivalent to np.polyfit(x, y, deg, w=w, cov=True), but solves the small
+    column-scaled normal equations directly instead of going through an SVD,
+    which is much cheaper for the handful of points in a dispersion fit.
+
+    Args:
+        x (numpy.ndarray): Array of x coordinates
+        y (numpy.ndarray): Array of y values
+        w (numpy.ndarray): Array of weights applied to the residuals (1/sigma)
+        deg (int): Degree of the polynomial
+
+    Returns:
+        coeff (numpy.ndarray): Polynomial coefficients, highest power first
+        cov (numpy.ndarray): Covariance matrix of the coefficients, scaled by the
+        reduced chi-square of the fit like np.polyfit
+    """
+    x = np.asarray(x, dtype=float)
+    w = np.asarray(w, dtype=float)
+    if len(x) <= deg + 1:
+        raise ValueError("the number of data points must exceed order "
+                         "to scale the covariance matrix")
+    lhs = np.vander(x, deg + 1) * w[:, np.newaxis]
+    rhs = np.asarray(y, dtype=float) * w
+    # scale the columns to improve the condition number of the normal matrix
+    scale = np.sqrt(np.sum(lhs * lhs, axis=0))
+    lhs /= scale
+    vbase = np.linalg.inv(lhs.T @ lhs)
+    coeff = vbase @ (lhs.T @ rhs)
+    resid = lhs @ coeff - rhs
+    fac = np.dot(resid, resid) / (len(x) - deg - 1)
+    return coeff / scale, vbase / np.outer(scale, scale) * fac
+
 def estimate_dispersion_clocking_angle(xpts, ypts, weights):
     """ 
     Estimate the clocking angle of the dispersion axis based on the centroids of
@@ -671,9 +705,9 @@ def fit_dispersion_polynomials(wavlens, xpts, ypts, cent_errs, clock_ang, ref_wa
     weights = 1 / pos_err
     lambda_func_x = np.poly1d(np.polyfit(x = delta_x, y = wavlens, deg = 2, w = weights))
     # Determine the position at the reference wavelength
-    poly_roots = (np.poly1d(lambda_func_x) - ref_wavlen).roots
+    poly_roots = (lambda_func_x - ref_wavlen).roots
     real_roots = poly_roots[np.isreal(poly_roots)]
-    root_select_ind = np.argmin(np.abs(poly_roots[np.isreal(poly_roots)]))
+    root_select_ind = np.argmin(np.abs(real_roots))
     pos_ref = np.real(real_roots[root_select_ind])
     np.testing.assert_almost_equal(lambda_func_x(pos_ref), ref_wavlen)
     displacements_mm = delta_x - pos_ref
@@ -683,12 +717,12 @@ def fit_dispersion_polynomials(wavlens, xpts, ypts, cent_errs, clock_ang, ref_wa
     #    function of wavelength  
     # 2. Wavelength as a function of displacement along the dispersion axis
     (pfit_pos_vs_wavlen,
-     cov_pos_vs_wavlen) = np.polyfit(x = (wavlens - ref_wavlen) / ref_wavlen,
-                                      y = displacements_mm, deg = 3, w = weights, cov=True)
+     cov_pos_vs_wavlen) = weighted_polyfit(x = (wavlens - ref_wavlen) / ref_wavlen,
+                                           y = displacements_mm, w = weights, deg = 3)
     
     (pfit_wavlen_vs_pos,
-     cov_wavlen_vs_pos) = np.polyfit(x = displacements_mm, y = wavlens, deg = 3, 
-                                      w = weights, cov=True)
+     cov_wavlen_vs_pos) = weighted_polyfit(x = displacements_mm, y = wavlens, 
+                                           w = weights, deg = 3)
 
     return pfit_pos_vs_wavlen, cov_pos_vs_wavlen, pfit_wavlen_vs_pos, cov_wavlen_vs_pos
 
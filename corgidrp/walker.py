@@ -28,6 +28,7 @@ all_steps = {
     "frame_select" : corgidrp.l2a_to_l2b.frame_select,
     "convert_to_electrons" : corgidrp.l2a_to_l2b.convert_to_electrons,
     "em_gain_division" : corgidrp.l2a_to_l2b.em_gain_division,
+    "convert_to_electrons_and_em_gain_division" : corgidrp.l2a_to_l2b.convert_to_electrons_and_em_gain_division,
     "cti_correction" : corgidrp.l2a_to_l2b.cti_correction,
     "correct_bad_pixels" : corgidrp.l2a_to_l2b.correct_bad_pixels,
     "desmear" : corgidrp.l2a_to_l2b.desmear,
@@ -276,6 +276,34 @@ def test_correct_headers():
         if not ("SAT_DN" in frame.ext_hdr):
             raise Exception("'SAT_DN' missing from frame header.")
 
+def test_dq_flags_not_double_counted():
+    """
+    Asserts that running detect_cosmic_rays on an already flagged dataset
+    does not change the DQ, since the flags are OR'd rather than added.
+    """
+    dataset = mocks.create_cr_dataset(nonlin_fits_filepath, filedir=datadir, numfiles=2,numCRs=5, plateau_length=10)
+    output_dataset = detect_cosmic_rays(dataset, detector_params)
+    output_dataset2 = detect_cosmic_rays(output_dataset, detector_params)
+
+    assert np.any(output_dataset.all_dq > 0)
+    assert np.array_equal(output_dataset2.all_dq, output_dataset.all_dq)
+
+def test_dq_flags_keep_high_bits():
+    """
+    Asserts that the saturation/CR flags are OR'd into the existing DQ without
+    disturbing DQ bits above 255.
+    """
+    dataset = mocks.create_cr_dataset(nonlin_fits_filepath, filedir=datadir, numfiles=2,numCRs=5, plateau_length=10)
+    output_dataset = detect_cosmic_rays(dataset, detector_params)
+
+    flagged_dataset = dataset.copy()
+    flagged_dataset.all_dq[:] |= 512
+    output_flagged_dataset = detect_cosmic_rays(flagged_dataset, detector_params)
+
+    assert np.any(output_dataset.all_dq & 32)
+    assert np.any(output_dataset.all_dq & 128)
+    assert np.array_equal(output_flagged_dataset.all_dq, output_dataset.all_dq | 512)
+
 def test_saturation_calc():
     """
     Asserts that FWC saturation threshold is calculated correctly.
@@ -43,6 +43,22 @@ def test_l1_to_l4():
         assert frame.ext_hdr['DATA_LEVEL'] == "L4"
         assert "L4" in frame.filename
 
+def test_l1_to_l2a_inplace():
+    """
+    Tests that update_to_l2a with inplace=True updates the input dataset itself
+    """
+    l1_dataset = mocks.create_prescan_files(obstype="SCI", numfiles=2)
+    fname_template = "CGI_L1_100_0200001001001100001_20270101T120000_{0:03d}.fits"
+    for i, image in enumerate(l1_dataset):
+        image.filename = fname_template.format(i)
+
+    l2a_dataset = l1_to_l2a.update_to_l2a(l1_dataset, inplace=True)
+
+    assert l2a_dataset is l1_dataset
+    for frame in l2a_dataset:
+        assert frame.ext_hdr['DATA_LEVEL'] == "L2a"
+        assert "L2a" in frame.filename
+
 def test_l1_to_l2a_bad():
     """
     Tests an unsuccessful upgrade of L1 to L2a data because the input is not L1
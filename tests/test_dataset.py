@@ -3,6 +3,7 @@ import pytest
 import numpy as np
 import astropy.io.fits as fits
 import corgidrp
+import corgidrp._kernels as kernels
 from corgidrp.data import Image, Dataset
 from corgidrp.mocks import create_default_headers
 
@@ -122,6 +123,106 @@ def test_split_dataset():
     sliced_datasets, unique_combos = orig_dataset.split_dataset(exthdr_keywords=['EXPTIME',])
     assert len(sliced_datasets) == 2
 
+def test_masked_mean(monkeypatch):
+    """
+    Test the DQ-aware mean over frames against numpy masked arrays, with and without numba
+    """
+    rng = np.random.default_rng(0)
+    frames = []
+    for i in range(5):
+        frame_dq = (rng.random((32, 32)) > 0.7).astype(int)
+        frames.append(Image(rng.normal(size=(32, 32)), err=np.zeros((32, 32)), dq=frame_dq, pri_hdr=prhd.copy(), ext_hdr=exthd.copy()))
+    # a pixel that is bad in every frame
+    for frame in frames:
+        frame.dq[0, 0] = 1
+    dataset = Dataset(frames)
+
+    expected = np.ma.masked_array(dataset.all_data, mask=dataset.all_dq > 0).mean(axis=0)
+
+    for use_numba in set([False, kernels.has_numba]):
+        monkeypatch.setattr(kernels, "has_numba", use_numba)
+        mean = dataset.masked_mean()
+        assert mean.shape == (32, 32)
+        assert np.isnan(mean[0, 0])
+        assert np.allclose(mean[~expected.mask], expected.compressed())
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_nanmean_nanstd(monkeypatch, dtype):
+    """
+    Test the one-pass NaN-ignoring mean and std over frames against numpy, with and without numba
+    """
+    rng = np.random.default_rng(2)
+    data = rng.normal(5, 2, size=(20, 16, 16)).astype(dtype)
+    data[rng.random(data.shape) < 0.1] = np.nan
+    # a pixel that is NaN in every frame
+    data[:, 0, 0] = np.nan
+
+    expected_mean = np.nanmean(data, axis=0)
+    expected_std = np.nanstd(data, axis=0)
+    rtol = 1e-12 if dtype == np.float64 else 1e-5
+
+    for use_numba in set([False, kernels.has_numba]):
+        monkeypatch.setattr(kernels, "has_numba", use_numba)
+        mean, std = kernels.nanmean_nanstd_axis0(data)
+        assert mean.dtype == dtype
+        assert std.dtype == dtype
+        assert np.isnan(mean[0, 0]) and np.isnan(std[0, 0])
+        assert np.allclose(mean, expected_mean, rtol=rtol, atol=0, equal_nan=True)
+        assert np.allclose(std, expected_std, rtol=rtol, atol=0, equal_nan=True)
+
+def test_parallel_stacking(monkeypatch):
+    """
+    Test that building the dataset cubes with the parallel kernel gives the same result as the serial copy
+    """
+    rng = np.random.default_rng(1)
+    frames = [Image(rng.normal(size=(16, 16)), err=rng.random((16, 16)), dq=rng.integers(0, 2, (16, 16)),
+                    pri_hdr=prhd.copy(), ext_hdr=exthd.copy()) for i in range(4)]
+    expected_data = np.array([frame.data for frame in frames])
+    expected_err = np.array([frame.err for frame in frames])
+    expected_dq = np.array([frame.dq for frame in frames])
+
+    monkeypatch.setattr(kernels, "parallel_stack_min_frames", 0)
+    dataset = Dataset(frames)
+    monkeypatch.undo()
+
+    assert np.array_equal(dataset.all_data, expected_data)
+    assert np.array_equal(dataset.all_err, expected_err)
+    assert np.array_equal(dataset.all_dq, expected_dq)
+    # frames still point to the cube
+    dataset[1].data[0, 0] = 1000
+    assert dataset.all_data[1, 0, 0] == 1000
+
+def test_parallel_save(tmp_path):
+    """
+    Test that saving a dataset in parallel writes the same files as saving serially
+    """
+    frames = [Image(np.copy(data) + i, err=np.copy(err), dq=np.copy(dq), pri_hdr=prhd.copy(), ext_hdr=exthd.copy()) for i in range(4)]
+    dataset = Dataset(frames)
+    filenames = ["frame{0}.fits".format(i) for i in range(len(dataset))]
+
+    dataset.save(filedir=str(tmp_path), filenames=filenames, parallel=True)
+
+    loaded = Dataset([os.path.join(str(tmp_path), filename) for filename in filenames])
+    assert np.array_equal(loaded.all_data, dataset.all_data)
+    assert np.array_equal(loaded.all_dq, dataset.all_dq)
+
+def test_parallel_save_duplicate_paths(tmp_path):
+    """
+    Test that frames saved to the same path are written one at a time, so the last frame wins
+    """
+    frames = [Image(np.copy(data) + i, err=np.copy(err), dq=np.copy(dq), pri_hdr=prhd.copy(), ext_hdr=exthd.copy()) for i in range(8)]
+    dataset = Dataset(frames)
+    filenames = ["frame.fits"] * len(dataset)
+
+    dataset.save(filedir=str(tmp_path), filenames=filenames, parallel=True)
+
+    loaded = Image(os.path.join(str(tmp_path), "frame.fits"))
+    assert np.array_equal(loaded.data, dataset[-1].data)
+
 if __name__ == "__main__":
     test_hashing()
-    test_split_dataset()
\ No newline at end of file
+    test_split_dataset()
+    with pytest.MonkeyPatch.context() as mp:
+        test_masked_mean(mp)
+    with pytest.MonkeyPatch.context() as mp:
+        test_parallel_stacking(mp)
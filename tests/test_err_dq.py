@@ -149,6 +149,13 @@ def test_get_masked_data():
     assert masked_data.mean()==2
     assert masked_data.sum()==image2.data.sum()-2
 
+    # a masked array that was already returned keeps its mask when the dq changes
+    image2.dq[0,1] = 1
+    masked_data2 = image2.get_masked_data()
+    assert masked_data2.mask[0,1] == True
+    assert masked_data.mask[0,1] == False
+    image2.dq[0,1] = 0
+
 
 def test_err_adderr_notrack():
     """
@@ -172,6 +179,31 @@ def test_err_adderr_notrack():
     assert image1.err[0,0,0] == np.sqrt(err1[0,0]**2 + err2[0,0]**2)
 
 
+def test_dataset_adderr_notrack():
+    """
+    test adding 2-D and 3-D error terms to a dataset when we are not tracking individual errors.
+    The combined error of every frame is updated and the frames stay linked to all_err.
+    """
+    corgidrp.track_individual_errors = False
+
+    image1 = Image(data,pri_hdr = prhd, ext_hdr = exthd)
+    image2 = Image(data,pri_hdr = prhd, ext_hdr = exthd)
+    dataset = Dataset([image1, image2])
+
+    dataset.add_error_term(err1, "error_noid")
+    dataset.add_error_term(np.stack([err2, 2*err2]), "error_nuts")
+    assert dataset.all_err.shape == (2,1,1024,1024)
+    assert dataset.all_err[0,0,0,0] == np.sqrt(err1[0,0]**2 + err2[0,0]**2)
+    assert dataset.all_err[1,0,0,0] == np.sqrt(err1[0,0]**2 + 4*err2[0,0]**2)
+    assert np.shares_memory(dataset[1].err, dataset.all_err)
+    assert dataset[1].err_hdr["Layer_1"] == "combined_error"
+    assert "error_nuts" in str(dataset[1].err_hdr["HISTORY"])
+
+    with pytest.raises(ValueError, match=r"2-dimensional error layer with dimensions \(1024, 1024\)"):
+        dataset.add_error_term(np.ones([10,10]), "wrong_shape")
+    with pytest.raises(ValueError, match=r"3-dimensional error layer with dimensions \(2, 1024, 1024\)"):
+        dataset.add_error_term(np.ones([3,1024,1024]), "wrong_shape")
+
 def test_read_many_errors_notrack():
     """
     Check that we can successfully discard errors when reading in a frame with multiple errors
@@ -44,6 +44,10 @@ def test_flat_div():
     assert np.mean(flat_frame.data) == pytest.approx(1, abs=1e-2)
     # check that the error is determined correctly
     assert np.array_equal(np.std(flat_dataset.all_data, axis = 0)/np.sqrt(len(flat_dataset)), flat_frame.err[0])
+    # a downsampled flat has the full shape and matches at the sampled pixels
+    coarse_flat_frame = detector.create_flatfield(flat_dataset, downsample=4)
+    assert coarse_flat_frame.data.shape == flat_frame.data.shape
+    assert np.array_equal(coarse_flat_frame.data[::4, ::4], flat_frame.data[::4, ::4])
 	# save flatfield
     calibdir = os.path.join(os.path.dirname(__file__), "testcalib")
     flat_filename = "sim_flat_calib.fits"
@@ -76,5 +76,33 @@ def test_kgain():
     assert gain_dataset[0].err_hdr["KGAIN"] == k_gain
     assert("converted" in str(gain_dataset[0].ext_hdr["HISTORY"]))
 
+    # test the combined kgain conversion and EM gain division matches the two separate steps
+    electrons_dataset = l2a_to_l2b.convert_to_electrons_and_em_gain_division(dataset, kgain)
+    separate_dataset = l2a_to_l2b.em_gain_division(gain_dataset)
+    assert np.allclose(electrons_dataset.all_data, separate_dataset.all_data)
+    assert np.allclose(electrons_dataset.all_err, separate_dataset.all_err)
+    assert electrons_dataset[0].ext_hdr["BUNIT"] == "detected electrons"
+    assert electrons_dataset[0].ext_hdr["KGAIN"] == k_gain
+    assert("converted" in str(electrons_dataset[0].ext_hdr["HISTORY"]))
+
+    # the unit conversions keep the precision of the input data
+    dataset32 = dataset.copy()
+    dataset32.all_data = dataset32.all_data.astype(np.float32)
+    for frame, frame_data in zip(dataset32.frames, dataset32.all_data):
+        frame.data = frame_data
+    assert l2a_to_l2b.convert_to_electrons(dataset32, kgain).all_data.dtype == np.float32
+    assert l2a_to_l2b.em_gain_division(dataset32).all_data.dtype == np.float32
+    assert l2a_to_l2b.convert_to_electrons_and_em_gain_division(dataset32, kgain).all_data.dtype == np.float32
+
+    # integer data can't hold the scaled values, so it is not silently truncated
+    dataset_int = dataset.copy()
+    dataset_int.all_data = dataset_int.all_data.astype(np.int64)
+    for frame, frame_data in zip(dataset_int.frames, dataset_int.all_data):
+        frame.data = frame_data
+    with pytest.raises(TypeError):
+        l2a_to_l2b.convert_to_electrons(dataset_int, kgain)
+    with pytest.raises(TypeError):
+        l2a_to_l2b.em_gain_division(dataset_int)
+
 if __name__ == "__main__":
     test_kgain()
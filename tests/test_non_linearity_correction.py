@@ -5,6 +5,7 @@ import numpy as np
 import corgidrp.mocks as mocks
 import corgidrp.data as data
 import corgidrp.l1_to_l2a as l1_to_l2a
+import corgidrp.detector as detector
 from scipy import interpolate
 import pytest
 
@@ -177,5 +178,35 @@ def test_non_linearity_correction():
     assert np.all(np.abs(linear_dataset.all_data[0]-linear_data_iit[0]) < 1e-5)
     # assert np.mean(linear_dataset.all_data - linear_data_iit) == pytest.approx(0, abs=1e-2)
 
+def test_non_linearity_correction_chunks(monkeypatch):
+    """
+    Test that correcting runs of frames with the same EM gain in chunks gives the same
+    result as correcting each frame with its own relative gains
+    """
+    input_non_linearity_path = os.path.join(os.path.dirname(__file__), "test_data", "nonlin_table_TVAC.txt")
+    tvac_nonlin_data = np.genfromtxt(input_non_linearity_path, delimiter=",")
+    pri_hdr, ext_hdr = mocks.create_default_headers()
+    non_linearity_correction = data.NonLinearityCalibration(tvac_nonlin_data, pri_hdr=pri_hdr, ext_hdr=ext_hdr,
+                                                            input_dataset=mocks.create_prescan_files())
+
+    rng = np.random.default_rng(0)
+    frames = []
+    for em_gain in [2000, 2000, 2000, 500, 500, 2000, 1]:
+        frame_ext_hdr = ext_hdr.copy()
+        frame_ext_hdr['CMDGAIN'] = em_gain
+        frames.append(data.Image(rng.uniform(0, 8000, (50, 60)), pri_hdr=pri_hdr.copy(), ext_hdr=frame_ext_hdr))
+    dataset = data.Dataset(frames)
+
+    expected = np.array([frame.data * detector.get_relgains(frame.data, frame.ext_hdr['CMDGAIN'], non_linearity_correction)
+                         for frame in dataset])
+
+    # chunks of one frame, two frames, and whole runs
+    for chunk_bytes in [1, 2 * 50 * 60 * 8, 1024**3]:
+        monkeypatch.setattr(l1_to_l2a, "nonlin_chunk_bytes", chunk_bytes)
+        linear_dataset = l1_to_l2a.correct_nonlinearity(dataset, non_linearity_correction)
+        assert np.array_equal(linear_dataset.all_data, expected)
+
 if __name__ == "__main__":
-    test_non_linearity_correction()
\ No newline at end of file
+    test_non_linearity_correction()
+    with pytest.MonkeyPatch.context() as mp:
+        test_non_linearity_correction_chunks(mp)
\ No newline at end of file
@@ -557,6 +557,27 @@ def test_bias_offset():
                 raise Exception(f"Bias offset subtraction did not produce the correct result. absmax value : {np.nanmax(np.abs(image_slice_0 - image_slice_10))}")
 
 
+def test_bias_float32():
+    """Verify prescan_biassub computes and stores the outputs in float32 when asked
+    to, and that they match the default double precision outputs."""
+
+    ###### create simulated data
+    datadir = os.path.join(os.path.dirname(__file__), "simdata")
+
+    for obstype in ['SCI', 'ENG']:
+        dataset = mocks.create_prescan_files(filedir=datadir, obstype=obstype,numfiles=2)
+
+        for return_full_frame in [True, False]:
+            output_dataset = prescan_biassub(dataset, noise_maps, return_full_frame=return_full_frame)
+            output_dataset32 = prescan_biassub(dataset, noise_maps, return_full_frame=return_full_frame, dtype=np.float32)
+
+            assert output_dataset32.all_data.dtype == np.float32
+            assert output_dataset32.all_err.dtype == np.float32
+            assert output_dataset32[0].data.dtype == np.float32
+            assert np.allclose(output_dataset32.all_data, output_dataset.all_data, rtol=1e-6, atol=1e-3)
+            assert np.allclose(output_dataset32.all_err, output_dataset.all_err, rtol=1e-6, atol=1e-3)
+
+
 if __name__ == "__main__":
     test_prescan_sub()
     test_bias_zeros_frame()
@@ -7,7 +7,7 @@ import corgidrp.mocks as mocks
 import corgidrp.data as data
 import corgidrp.spectroscopy as spectroscopy
 from astropy.io import fits
-import itertools
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 from pathlib import Path
 from astropy.table import Table, Column
@@ -20,13 +20,180 @@ import scipy.ndimage as ndi
 
 import matplotlib.pyplot as plt
 
-def test_fit_psf_centroid(errortol_pix = 0.01, verbose = False):
+class _SpectroscopyTestData():
+    """
+    Reader for the spectroscopy test data that opens each FITS file once, memory-mapped,
+    and only parses each extension and table once. The returned arrays and tables are
+    shared between tests, so they are read-only (or must not be modified). Closing it
+    closes all of the opened files.
+    """
+    def __init__(self):
+        self._hdulists = {}
+        self._data = {}
+        self._tables = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Close every opened FITS file and drop the cached data.
+        """
+        self._data.clear()
+        self._tables.clear()
+        for hdulist in self._hdulists.values():
+            hdulist.close()
+        self._hdulists.clear()
+
+    def _open(self, fname):
+        """
+        Open a test data FITS file, or return it if it is already open.
+
+        Args:
+            fname (str): path to the FITS file
+
+        Returns:
+            astropy.io.fits.HDUList: the opened (memory-mapped) FITS file
+        """
+        if fname not in self._hdulists:
+            self._hdulists[fname] = fits.open(fname, memmap=True, lazy_load_hdus=True)
+        return self._hdulists[fname]
+
+    def getdata(self, fname, ext=0):
+        """
+        fits.getdata that only reads each test data extension once. Image data is
+        returned as the memory-mapped array itself, without a copy.
+
+        Args:
+            fname (str): path to the FITS file
+            ext (int): extension to read
+
+        Returns:
+            np.ndarray or FITS_rec: the (read-only) data of the extension
+        """
+        if (fname, ext) not in self._data:
+            ext_data = self._open(fname)[ext].data
+            ext_data.flags.writeable = False
+            self._data[(fname, ext)] = ext_data
+        return self._data[(fname, ext)]
+
+    def getheader(self, fname, ext=0):
+        """
+        fits.getheader on a test data file, read through the already opened file.
+
+        Args:
+            fname (str): path to the FITS file
+            ext (int): extension to read
+
+        Returns:
+            astropy.io.fits.Header: a copy of the header of the extension
+        """
+        return self._open(fname)[ext].header.copy()
+
+    def read_csv(self, fname):
+        """
+        pd.read_csv (with the first column as the index) that only reads each table once.
+
+        Args:
+            fname (str): path to the CSV file
+
+        Returns:
+            pandas.DataFrame: the table. Callers must not modify it, since it is shared between tests.
+        """
+        if fname not in self._tables:
+            self._tables[fname] = pd.read_csv(fname, index_col=0)
+        return self._tables[fname]
+
+@pytest.fixture(scope="module")
+def spec_test_data():
+    """
+    Spectroscopy test data shared by the tests in this module; the files are closed
+    when the module is done.
+    """
+    with _SpectroscopyTestData() as test_data:
+        yield test_data
+
+def _batched_xcorr_offsets(psf_array, pairs):
+    """
+    Estimate the (x,y) offset between the PSFs of every pair from the peak of their
+    cross-correlation. The FFT of every PSF is computed once and all of the pairs are
+    cross-correlated with a single inverse FFT. The peak is refined to sub-pixel
+    precision with a 3-point Gaussian fit along each axis.
+
+    Args:
+        psf_array (np.ndarray): stack of PSF images, 3D array
+        pairs (np.ndarray): (P, 2) array of (template index, data index) pairs
+
+    Returns:
+        xoffsets (np.ndarray): x offset of the data PSF from the template PSF for each pair, pixels
+        yoffsets (np.ndarray): y offset of the data PSF from the template PSF for each pair, pixels
+    """
+    ny, nx = psf_array.shape[-2:]
+    psf_fft = np.fft.rfft2(psf_array, axes=(-2,-1))
+    xcorr = np.fft.irfft2(psf_fft[pairs[:,1]] * psf_fft[pairs[:,0]].conj(), s=(ny, nx), axes=(-2,-1))
+    xcorr = np.fft.fftshift(xcorr, axes=(-2,-1))
+
+    pair_inds = np.arange(len(pairs))
+    ypeak, xpeak = np.unravel_index(xcorr.reshape(len(pairs), -1).argmax(axis=1), (ny, nx))
+    log_xcorr = np.log(np.clip(xcorr, np.finfo(xcorr.dtype).tiny, None))
+    def gauss_peak_shift(left, center, right):
+        return 0.5 * (left - right) / (left - 2 * center + right)
+    xshift = gauss_peak_shift(log_xcorr[pair_inds, ypeak, xpeak-1], log_xcorr[pair_inds, ypeak, xpeak],
+                              log_xcorr[pair_inds, ypeak, xpeak+1])
+    yshift = gauss_peak_shift(log_xcorr[pair_inds, ypeak-1, xpeak], log_xcorr[pair_inds, ypeak, xpeak],
+                              log_xcorr[pair_inds, ypeak+1, xpeak])
+
+    return xpeak + xshift - nx // 2, ypeak + yshift - ny // 2
+
+def _print_centroid_fit(template_idx, data_idx, true_cent_template, true_cent_data,
+                        fit_cent, fit_cent_gauss):
+    """
+    Print the true and fitted centroids of one PSF template fit in test_fit_psf_centroid.
+
+    Args:
+        template_idx (int): slice of the PSF array used as the template
+        data_idx (int): slice of the PSF array used as the test image
+        true_cent_template (tuple): true (x,y) position of the source in the template
+        true_cent_data (tuple): true (x,y) position of the source in the test image
+        fit_cent (tuple): (x,y) centroid estimate from the template fit
+        fit_cent_gauss (tuple): (x,y) centroid estimate from the 2D Gaussian profile fit
+    """
+    (true_xcent_template, true_ycent_template) = true_cent_template
+    (true_xcent_data, true_ycent_data) = true_cent_data
+    (xfit, yfit) = fit_cent
+    (xfit_gauss, yfit_gauss) = fit_cent_gauss
+    print(f"True source (x,y) position in test PSF image (slice {data_idx})\n" + 
+          f"{true_xcent_data:.3f}, {true_ycent_data:.3f}")
+    print(f"True source (x,y) position in PSF template (slice {template_idx})\n" + 
+          f"{true_xcent_template:.3f}, {true_ycent_template:.3f}")
+    print(f"True source offset from template PSF to test PSF: \n" + 
+          f"{true_xcent_data - true_xcent_template:.3f}, {true_ycent_data - true_ycent_template:.3f}")
+    print("Centroid (x,y) estimate from template fit for test PSF image:\n" + 
+            f"{xfit:.3f}, {yfit:.3f}")
+    print(f"Gaussian profile fit centroid (x,y) estimate for PSF test image:\n" + 
+            f"{xfit_gauss:.3f}, {yfit_gauss:.3f}")
+    print("Centroid (x,y) errors:\n" + 
+          f"{xfit - true_xcent_data:.3f}, {yfit - true_ycent_data:.3f} (PSF template fit)\n" + 
+          f"{xfit_gauss - true_xcent_data:.3f}, {yfit_gauss - true_ycent_data:.3f} (2D Gaussian profile fit)\n") 
+
+def test_fit_psf_centroid(spec_test_data, errortol_pix = 0.01, xcorr_errortol_pix = 0.02, num_fit_pairs = 25, fit_pairs_seed = 0, verbose = False):
     """
     Test the accuracy of the PSF centroid fitting function with an array of simulated 
     noiseless SPC prism EXCAM images computed for a grid of offsets.
 
+    The offsets between every pair of PSFs are checked with a batched FFT cross-correlation,
+    and the full template fit of fit_psf_centroid is checked on a seeded random subsample of the
+    pairs, both against the true offsets and against the cross-correlation offsets of the same pairs.
+
     Args:
+        spec_test_data (_SpectroscopyTestData): reader for the shared spectroscopy test data
         errortol_pix (float): Tolerance on centroid errors on each axis, in EXCAM pixels
+        xcorr_errortol_pix (float): Tolerance on the cross-correlation offset errors on each axis, in EXCAM pixels
+        num_fit_pairs (int): Number of PSF pairs to run the template fit on
+        fit_pairs_seed (int): Seed of the random choice of the PSF pairs to run the template fit on
         verbose (bool): If verbose=True, print the results from each individual test
     """
     print('Testing the PSF centroid fitting function used by the spectroscopy wavecal recipe...')
@@ -34,22 +201,40 @@ def test_fit_psf_centroid(errortol_pix = 0.01, verbose = False):
     test_data_path = os.path.join(os.path.dirname(corgidrp.__path__[0]), "tests", "test_data", "spectroscopy")
     spc_offset_psf_array_fname = os.path.join(test_data_path, 
             'g0v_vmag6_spc-spec_band3_unocc_CFAM3d_NOSLIT_PRISM3_offset_array.fits')
-    psf_array = fits.getdata(spc_offset_psf_array_fname, ext=0)
-    psf_truth_table = fits.getdata(spc_offset_psf_array_fname , ext=1)
-
-    offset_inds = range(psf_array.shape[0])
-    xerr_list = list()
-    yerr_list = list()
-    xerr_gauss_list = list()
-    yerr_gauss_list = list()
-
-    for (template_idx, data_idx) in itertools.combinations(offset_inds, 2):
+    psf_array = spec_test_data.getdata(spc_offset_psf_array_fname, ext=0)
+    psf_truth_table = spec_test_data.getdata(spc_offset_psf_array_fname, ext=1)
+    true_xcents = np.asarray(psf_truth_table['xcent'])
+    true_ycents = np.asarray(psf_truth_table['ycent'])
+
+    # every (template, data) pair of offset PSFs, in itertools.combinations order
+    pairs = np.column_stack(np.triu_indices(psf_array.shape[0], k=1))
+
+    # coarse check of every pair at once
+    xoffsets, yoffsets = _batched_xcorr_offsets(psf_array.astype(np.float32), pairs)
+    err_xoffsets = xoffsets - (true_xcents[pairs[:,1]] - true_xcents[pairs[:,0]])
+    err_yoffsets = yoffsets - (true_ycents[pairs[:,1]] - true_ycents[pairs[:,0]])
+    max_err_xoffset = np.max(np.abs(err_xoffsets))
+    max_err_yoffset = np.max(np.abs(err_yoffsets))
+    assert max_err_xoffset < xcorr_errortol_pix, \
+            f"Accuracy failure: x-axis cross-correlation offset error {max_err_xoffset:.1E} pixels versus {xcorr_errortol_pix:.1E} pixel tolerance"
+    assert max_err_yoffset < xcorr_errortol_pix, \
+            f"Accuracy failure: y-axis cross-correlation offset error {max_err_yoffset:.1E} pixels versus {xcorr_errortol_pix:.1E} pixel tolerance"
+
+    rng = np.random.default_rng(fit_pairs_seed)
+    fit_pair_inds = rng.choice(len(pairs), size=min(num_fit_pairs, len(pairs)), replace=False)
+    subsample_desc = f"{len(fit_pair_inds)} of {len(pairs)} PSF pairs (seed {fit_pairs_seed})"
+    xerr = np.empty(len(fit_pair_inds))
+    yerr = np.empty(len(fit_pair_inds))
+    xerr_gauss = np.empty(len(fit_pair_inds))
+    yerr_gauss = np.empty(len(fit_pair_inds))
+    for k, pair_idx in enumerate(fit_pair_inds):
+        (template_idx, data_idx) = pairs[pair_idx]
         psf_template = psf_array[template_idx]
         psf_data = psf_array[data_idx]
-        (true_xcent_template, true_ycent_template) = (psf_truth_table['xcent'][template_idx], 
-                                                      psf_truth_table['ycent'][template_idx])
-        (true_xcent_data, true_ycent_data) = (psf_truth_table['xcent'][data_idx], 
-                                              psf_truth_table['ycent'][data_idx])
+        (true_xcent_template, true_ycent_template) = (true_xcents[template_idx], 
+                                                      true_ycents[template_idx])
+        (true_xcent_data, true_ycent_data) = (true_xcents[data_idx], 
+                                              true_ycents[data_idx])
 
         (xfit, yfit,
          xfit_gauss, yfit_gauss, 
@@ -62,38 +247,73 @@ def test_fit_psf_centroid(errortol_pix = 0.01, verbose = False):
                               yfit - true_ycent_data)
         err_xfit_gauss, err_yfit_gauss = (xfit_gauss - true_xcent_data, 
                                           yfit_gauss - true_ycent_data)
-        xerr_list.append(err_xfit)
-        yerr_list.append(err_yfit)
-        xerr_gauss_list.append(err_xfit_gauss)
-        yerr_gauss_list.append(err_yfit_gauss)
+        xerr[k], yerr[k] = err_xfit, err_yfit
+        xerr_gauss[k], yerr_gauss[k] = err_xfit_gauss, err_yfit_gauss
 
         if verbose:
-            print(f"True source (x,y) position in test PSF image (slice {data_idx})\n" + 
-                  f"{true_xcent_data:.3f}, {true_ycent_data:.3f}")
-            print(f"True source (x,y) position in PSF template (slice {template_idx})\n" + 
-                  f"{true_xcent_template:.3f}, {true_ycent_template:.3f}")
-            print(f"True source offset from template PSF to test PSF: \n" + 
-                  f"{true_xcent_data - true_xcent_template:.3f}, {true_ycent_data - true_ycent_template:.3f}")
-            print("Centroid (x,y) estimate from template fit for test PSF image:\n" + 
-                    f"{xfit:.3f}, {yfit:.3f}")
-            print(f"Gaussian profile fit centroid (x,y) estimate for PSF test image:\n" + 
-                    f"{xfit_gauss:.3f}, {yfit_gauss:.3f}")
-            print("Centroid (x,y) errors:\n" + 
-                  f"{err_xfit:.3f}, {err_yfit:.3f} (PSF template fit)\n" + 
-                  f"{err_xfit_gauss:.3f}, {err_yfit_gauss:.3f} (2D Gaussian profile fit)\n") 
+            _print_centroid_fit(template_idx, data_idx,
+                                (true_xcent_template, true_ycent_template),
+                                (true_xcent_data, true_ycent_data),
+                                (xfit, yfit), (xfit_gauss, yfit_gauss))
 
+        pair_desc = f"template {template_idx}, data {data_idx}; one of {subsample_desc}"
         assert err_xfit == pytest.approx(0, abs=errortol_pix), \
-                f"Accuracy failure: x-axis centroid error {err_xfit:.1E} pixels versus {errortol_pix:.1E} pixel tolerance"
+                f"Accuracy failure: x-axis centroid error {err_xfit:.1E} pixels versus {errortol_pix:.1E} pixel tolerance ({pair_desc})"
         assert err_yfit == pytest.approx(0, abs=errortol_pix), \
-                f"Accuracy failure: y-axis centroid error {err_yfit:.1E} pixels versus {errortol_pix:.1E} pixel tolerance"
-
-    print(f"Std dev of (x,y) centroid errors from {len(xerr_list)} PSF template fit tests:\n" + 
-          f"{np.std(xerr_list):.2E}, {np.std(yerr_list):.2E} pixels")
-    print(f"Std dev of (x,y) centroid errors from {len(xerr_list)} Gaussian profile fit tests:\n" + 
-          f"{np.std(xerr_gauss_list):.2E}, {np.std(yerr_gauss_list):.2E} pixels")
+                f"Accuracy failure: y-axis centroid error {err_yfit:.1E} pixels versus {errortol_pix:.1E} pixel tolerance ({pair_desc})"
+
+        # the template fit offset must also agree with the coarse cross-correlation offset of the same pair
+        (xoffset_fit, yoffset_fit) = (xfit - true_xcent_template, yfit - true_ycent_template)
+        assert xoffset_fit == pytest.approx(xoffsets[pair_idx], abs=errortol_pix + xcorr_errortol_pix), \
+                f"Template fit x offset {xoffset_fit:.3f} disagrees with the cross-correlation offset {xoffsets[pair_idx]:.3f} ({pair_desc})"
+        assert yoffset_fit == pytest.approx(yoffsets[pair_idx], abs=errortol_pix + xcorr_errortol_pix), \
+                f"Template fit y offset {yoffset_fit:.3f} disagrees with the cross-correlation offset {yoffsets[pair_idx]:.3f} ({pair_desc})"
+
+    print(f"Std dev of (x,y) offset errors from {len(pairs)} PSF cross-correlation tests:\n" + 
+          f"{np.std(err_xoffsets):.2E}, {np.std(err_yoffsets):.2E} pixels")
+    print(f"Std dev of (x,y) centroid errors from PSF template fit tests on {subsample_desc}:\n" + 
+          f"{np.std(xerr):.2E}, {np.std(yerr):.2E} pixels")
+    print(f"Std dev of (x,y) centroid errors from Gaussian profile fit tests on {subsample_desc}:\n" + 
+          f"{np.std(xerr_gauss):.2E}, {np.std(yerr_gauss):.2E} pixels")
     print("PSF centroid fit accuracy test passed.")
 
-def test_dispersion_fit(errortol_nm = 0.5, prism = 'PRISM3', test_product_path = None):
+def test_psf_registration_costfunc():
+    """
+    Test that the PSF registration cost function matches a bilinear scipy shift of the template,
+    including shifts that move part of the template off of the stamp, and that it rejects
+    a data stamp with a different shape than the template.
+    """
+    rng = np.random.default_rng(0)
+    template = rng.random((21, 21))
+    data_stamp = rng.random((21, 21))
+    for (xshift, yshift, amp) in [(0.3, -0.7, 1.2), (2.5, 1.25, 0.8), (-3.9, 0.0, 1.0), (0.0, 0.0, 2.0)]:
+        expected = np.sum((data_stamp - amp * ndi.shift(template, (yshift, xshift), order=1, prefilter=False))**2)
+        cost = spectroscopy.psf_registration_costfunc((xshift, yshift, amp), template, data_stamp)
+        assert cost == pytest.approx(expected, rel=1e-12)
+
+    # a data stamp truncated at the edge of the frame doesn't match the template
+    with pytest.raises(ValueError):
+        spectroscopy.psf_registration_costfunc((0.3, -0.7, 1.2), template, data_stamp[:15])
+
+def test_weighted_polyfit():
+    """
+    Test that the normal-equations polynomial fit used for the dispersion profile
+    matches np.polyfit, including the scaled covariance matrix.
+    """
+    rng = np.random.default_rng(1)
+    x = np.sort(rng.uniform(-1.5, 1.5, 8))
+    y = 700 + 80 * x + 3 * x**2 - x**3 + rng.normal(0, 0.3, x.size)
+    weights = 1 / rng.uniform(0.01, 0.05, x.size)
+
+    coeff, cov = spectroscopy.weighted_polyfit(x, y, weights, deg=3)
+    coeff_np, cov_np = np.polyfit(x, y, deg=3, w=weights, cov=True)
+    assert coeff == pytest.approx(coeff_np, rel=1e-9)
+    assert cov == pytest.approx(cov_np, rel=1e-9)
+
+    with pytest.raises(ValueError):
+        spectroscopy.weighted_polyfit(x[:4], y[:4], weights[:4], deg=3)
+
+def test_dispersion_fit(spec_test_data, errortol_nm = 0.5, prism = 'PRISM3', test_product_path = None):
     """ 
     Test the function that fits the spectral dispersion profile of the CGI ZOD prism.
 
@@ -103,6 +323,7 @@ def test_dispersion_fit(errortol_nm = 0.5, prism = 'PRISM3', test_product_path =
     based on the estimation of the input dispersion profile.
 
     Args:
+        spec_test_data (_SpectroscopyTestData): reader for the shared spectroscopy test data
     
     errortol_nm (numpy.float): Tolerance on the worst-case wavelength
     disagreement between the input (TVAC) dispersion model and the estimated dispersion
@@ -151,43 +372,40 @@ def test_dispersion_fit(errortol_nm = 0.5, prism = 'PRISM3', test_product_path =
             Path(prism_filtersweep_offsets_sim_fname).stem + '_centroids.csv')
     
     bandpass_center_table_fname = os.path.join(test_data_path, "CGI_bandpass_centers.csv")
-    bandpass_center_table = pd.read_csv(bandpass_center_table_fname, index_col=0)
-    tvac_centwav_exists = [centwav > 0 for centwav in bandpass_center_table['TVAC TV-40b center wavelength (nm)']]
+    bandpass_center_table = spec_test_data.read_csv(bandpass_center_table_fname)
+    tvac_centwav_exists = bandpass_center_table['TVAC TV-40b center wavelength (nm)'].to_numpy() > 0
     tvac_filters = bandpass_center_table.index.values[tvac_centwav_exists]
     
-    template_array = fits.getdata(prism_filtersweep_nooffsets_sim_fname, ext=0)
-    template_pos_table = Table(fits.getdata(prism_filtersweep_nooffsets_sim_fname, ext=1))
-    data_array = fits.getdata(prism_filtersweep_offsets_sim_fname, ext=0)
-    filtersweep_table = Table(fits.getdata(prism_filtersweep_offsets_sim_fname, ext=1))
-    filtersweep_hdr = fits.getheader(prism_filtersweep_offsets_sim_fname, ext=0)
+    template_array = spec_test_data.getdata(prism_filtersweep_nooffsets_sim_fname, ext=0)
+    template_pos_table = Table(spec_test_data.getdata(prism_filtersweep_nooffsets_sim_fname, ext=1))
+    data_array = spec_test_data.getdata(prism_filtersweep_offsets_sim_fname, ext=0)
+    filtersweep_table = Table(spec_test_data.getdata(prism_filtersweep_offsets_sim_fname, ext=1))
+    filtersweep_hdr = spec_test_data.getheader(prism_filtersweep_offsets_sim_fname, ext=0)
     true_clocking_angle = filtersweep_hdr['PRISMANG']
 
     # Add random noise to the filter sweep template images to serve as fake data
     np.random.seed(5)
     read_noise = 200
-    noisy_data_array = (np.random.poisson(np.abs(data_array) / 2) + 
-                        np.random.normal(loc=0, scale=read_noise, size=data_array.shape))
+    # the noise is drawn in the same order as before so the seeded realization is unchanged,
+    # but the read noise is added in place instead of through a second full-size temporary.
+    # float32 is plenty for the fake data given the 200 e- read noise.
+    noisy_data_array = np.random.poisson(np.abs(data_array) / 2).astype(np.float32)
+    noisy_data_array += np.random.normal(loc=0, scale=read_noise, size=data_array.shape)
 
     template_pos_table.add_index('CFAM')
     filtersweep_table.add_index('CFAM')
-    template_pos_table['CFAM'] = [cfam.upper().strip() for cfam in template_pos_table['CFAM']]
-    filtersweep_table['CFAM'] = [cfam.upper().strip() for cfam in filtersweep_table['CFAM']]
-    filtersweep_table.add_column(Column(name='center wavel (nm)', data=[0.]*len(filtersweep_table)), index=1)
-    filtersweep_table.rename_column('xoffset', 'CFAM x offset')
-    filtersweep_table.rename_column('yoffset', 'CFAM y offset')
-    filtersweep_table.rename_column('xcent', 'true x_cent')
-    filtersweep_table.rename_column('ycent', 'true y_cent')
-    filtersweep_table['x_cent'] = 0.
-    filtersweep_table['y_cent'] = 0.
-    filtersweep_table['x_cent offset corr'] = 0.
-    filtersweep_table['y_cent offset corr'] = 0.
-    filtersweep_table['x_cent gauss'] = 0.
-    filtersweep_table['y_cent gauss'] = 0.
-    filtersweep_table['peak pix SNR'] = 0.
-    filtersweep_table['x_err est'] = 0.
-    filtersweep_table['y_err est'] = 0.
-
-    for i, cfam in enumerate(filtersweep_table['CFAM']):
+    template_pos_table['CFAM'] = np.char.strip(np.char.upper(np.asarray(template_pos_table['CFAM'], dtype=str)))
+    filtersweep_table['CFAM'] = np.char.strip(np.char.upper(np.asarray(filtersweep_table['CFAM'], dtype=str)))
+    filtersweep_table.rename_columns(['xoffset', 'yoffset', 'xcent', 'ycent'],
+                                     ['CFAM x offset', 'CFAM y offset', 'true x_cent', 'true y_cent'])
+    # add all of the result columns in one go; the wavelength goes right after CFAM, the rest at the end
+    result_colnames = ['center wavel (nm)', 'x_cent', 'y_cent', 'x_cent offset corr', 'y_cent offset corr',
+                       'x_cent gauss', 'y_cent gauss', 'peak pix SNR', 'x_err est', 'y_err est']
+    filtersweep_table.add_columns([Column(name=colname, data=np.zeros(len(filtersweep_table)))
+                                   for colname in result_colnames],
+                                  indexes=[1] + [len(filtersweep_table.columns)] * (len(result_colnames) - 1))
+
+    def fit_filter_centroid(i, cfam):
         if cfam == '3': # larger fitting stamp needed for broadband filter 
             halfheight = 30
         else:
@@ -195,26 +413,24 @@ def test_dispersion_fit(errortol_nm = 0.5, prism = 'PRISM3', test_product_path =
     
         psf_data = noisy_data_array[i]
         psf_template = template_array[i]
-        (xcent_fit, ycent_fit, 
-         xcent_gauss, ycent_gauss,
-         psf_peakpix_snr,
-         xprecis, yprecis) = spectroscopy.fit_psf_centroid(psf_data, psf_template, 
+        return spectroscopy.fit_psf_centroid(psf_data, psf_template, 
                                           xcent_template=template_pos_table.loc[cfam]['xcent'],
                                           ycent_template=template_pos_table.loc[cfam]['ycent'],
                                           halfheight=halfheight)
-    
-        filtersweep_table['x_cent'][i] = xcent_fit
-        filtersweep_table['y_cent'][i] = ycent_fit
-        filtersweep_table['x_cent gauss'][i] = xcent_gauss
-        filtersweep_table['y_cent gauss'][i] = ycent_gauss
-        filtersweep_table['peak pix SNR'][i] = psf_peakpix_snr
-        filtersweep_table['x_err est'][i] = xprecis
-        filtersweep_table['y_err est'][i] = yprecis
-    
-        if cfam in tvac_filters:
-            filtersweep_table.loc[cfam]['center wavel (nm)'] = bandpass_center_table.loc[cfam,'TVAC TV-40b center wavelength (nm)']
-        else:
-            filtersweep_table.loc[cfam]['center wavel (nm)'] = bandpass_center_table.loc[cfam,'Phase C center wavelength (nm)']
+
+    # the fits of the different filters are independent, so run them concurrently
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        fit_results = list(executor.map(fit_filter_centroid, range(len(filtersweep_table)), filtersweep_table['CFAM']))
+    (filtersweep_table['x_cent'], filtersweep_table['y_cent'],
+     filtersweep_table['x_cent gauss'], filtersweep_table['y_cent gauss'],
+     filtersweep_table['peak pix SNR'],
+     filtersweep_table['x_err est'], filtersweep_table['y_err est']) = np.array(fit_results, dtype=float).T
+
+    # Use the TVAC center wavelength where it was measured, otherwise the Phase C value
+    cfams = np.array(filtersweep_table['CFAM'])
+    tvac_wavlens = bandpass_center_table['TVAC TV-40b center wavelength (nm)'].reindex(cfams).to_numpy()
+    phase_c_wavlens = bandpass_center_table['Phase C center wavelength (nm)'].reindex(cfams).to_numpy()
+    filtersweep_table['center wavel (nm)'] = np.where(np.isin(cfams, tvac_filters), tvac_wavlens, phase_c_wavlens)
     # Subtract the 'known' CFAM image offsets from the centroid estimates.
     filtersweep_table['CFAM x offset'] = filtersweep_table['CFAM x offset'] - filtersweep_table.loc[ref_cfam]['CFAM x offset']
     filtersweep_table['CFAM y offset'] = filtersweep_table['CFAM y offset'] - filtersweep_table.loc[ref_cfam]['CFAM y offset']
@@ -227,7 +443,7 @@ def test_dispersion_fit(errortol_nm = 0.5, prism = 'PRISM3', test_product_path =
         filtersweep_table['x_err gauss true'] = filtersweep_table['x_cent gauss'] - filtersweep_table['true x_cent']
         filtersweep_table['y_err gauss true'] = filtersweep_table['y_cent gauss'] - filtersweep_table['true y_cent']
 
-    subband_mask = [cfam in subband_list for cfam in filtersweep_table['CFAM']]
+    subband_mask = np.isin(np.asarray(filtersweep_table['CFAM']), subband_list)
     meas = filtersweep_table[subband_mask]
     assert len(meas) >= 4, 'Need images taken in at least four sub-band filters to model the dispersion'
 
@@ -244,20 +460,14 @@ def test_dispersion_fit(errortol_nm = 0.5, prism = 'PRISM3', test_product_path =
             meas['center wavel (nm)'],meas['x_cent offset corr'], meas['y_cent offset corr'], 
             meas['y_err est'], clocking_angle, ref_wavlen, pixel_pitch_um 
      )
-    pos_func_wavlen = np.poly1d(pfit_pos_vs_wavlen)
-    wavlen_func_pos = np.poly1d(pfit_wavlen_vs_pos)
 
     #### Load TVAC dispersion profile to compare and test the agreement in the wavelength vs position.
-    tvac_wavlen_func_pos = np.poly1d(tvac_dispersion.wavlen_vs_pos_polycoeff)
-    tvac_pos_func_wavlen = np.poly1d(tvac_dispersion.pos_vs_wavlen_polycoeff)    
-
-    (xtest_min, xtest_max) = (tvac_pos_func_wavlen((bandpass[0] - ref_wavlen)/ref_wavlen),
-                              tvac_pos_func_wavlen((bandpass[1] - ref_wavlen)/ref_wavlen))
+    (xtest_min, xtest_max) = np.polyval(tvac_dispersion.pos_vs_wavlen_polycoeff,
+                                        (np.asarray(bandpass[:2]) - ref_wavlen)/ref_wavlen)
 
     xtest = np.linspace(xtest_min, xtest_max, 1000)
-    tvac_model_wavlens = tvac_wavlen_func_pos(xtest)
-    corgi_model_wavlens = wavlen_func_pos(xtest)
-    wavlen_model_error = corgi_model_wavlens - tvac_model_wavlens
+    # the difference of the two models is itself a polynomial, so evaluate it in a single pass
+    wavlen_model_error = np.polyval(np.polysub(pfit_wavlen_vs_pos, tvac_dispersion.wavlen_vs_pos_polycoeff), xtest)
     worst_case_wavlen_error = np.abs(wavlen_model_error).max()
     print(f"Worst case wavelength disagreement from the test input model: {worst_case_wavlen_error:.2f} nm")
     assert worst_case_wavlen_error == pytest.approx(0, abs=errortol_nm)
@@ -284,13 +494,14 @@ def test_dispersion_fit(errortol_nm = 0.5, prism = 'PRISM3', test_product_path =
 
     return prism_filtersweep_centroid_table_fname, corgi_dispersion_profile
 
-def test_zeropoint_centroid(errortol_pix = 0.5):
+def test_zeropoint_centroid(spec_test_data, errortol_pix = 0.5):
     """ 
 
     Test the procedure for estimating the centroid of the zero-point image
     (satellite spot or PSF) taken through the narrowband filter and slit.
 
     Args:
+        spec_test_data (_SpectroscopyTestData): reader for the shared spectroscopy test data
         
         errortol_pix (numpy.float): Tolerance on the standard deviation of
         the registration error distribution across the trials.
@@ -302,8 +513,8 @@ def test_zeropoint_centroid(errortol_pix = 0.5):
     prism_slit_offset_psf_array_fname = os.path.join(test_data_path, 
             'g0v_vmag6_spc-spec_band3_unocc_CFAM3d_R1C2SLIT_PRISM3_offset_array.fits')
     
-    psf_template_array = fits.getdata(prism_slit_offset_psf_array_fname, ext=0)
-    template_offset_table = Table(fits.getdata(prism_slit_offset_psf_array_fname , ext=1))
+    psf_template_array = spec_test_data.getdata(prism_slit_offset_psf_array_fname, ext=0)
+    template_offset_table = Table(spec_test_data.getdata(prism_slit_offset_psf_array_fname, ext=1))
     num_rows_template = len(template_offset_table)
     template_offset_table['peak crosscorr'] = 0.
     
@@ -361,7 +572,7 @@ def test_zeropoint_centroid(errortol_pix = 0.5):
     print(f"Std of {num_trials:d} source-to-slit vertical offset errors: {np.std(source_to_slit_offset_errs):.2f} pixels")
     assert np.std(source_to_slit_offset_errs) == pytest.approx(0, abs=errortol_pix)
 
-def test_star_spectrum_registration(errortol_pix = 0.5):
+def test_star_spectrum_registration(spec_test_data, errortol_pix = 0.5):
     """
 
     Test the procedure for registering the unocculted star spectrum image from
@@ -369,6 +580,7 @@ def test_star_spectrum_registration(errortol_pix = 0.5):
     whose centroid best matches the wavelength calibration zero-point position.
     
     Args:
+        spec_test_data (_SpectroscopyTestData): reader for the shared spectroscopy test data
         
         errortol_pix (numpy.float): Tolerance on the registration offset between
         the noisy spectrum image and the best-matched template.
@@ -386,8 +598,8 @@ def test_star_spectrum_registration(errortol_pix = 0.5):
             test_product_path,
             Path(prism_slit_offset_spec_array_fname).stem + '_centroids.csv')
 
-    spec_template_array = fits.getdata(prism_slit_offset_spec_array_fname)
-    centroid_table = Table(fits.getdata(prism_slit_offset_spec_array_fname, ext=1))
+    spec_template_array = spec_test_data.getdata(prism_slit_offset_spec_array_fname)
+    centroid_table = Table(spec_test_data.getdata(prism_slit_offset_spec_array_fname, ext=1))
     num_rows_template = len(centroid_table)
 
     wave_cal_fname = os.path.join(test_product_path,
@@ -419,8 +631,8 @@ def test_star_spectrum_registration(errortol_pix = 0.5):
 
     np.random.seed(5)
     read_noise = 200
-    noisy_spec_array = (np.random.poisson(np.abs(spec_template_array) / 2) + 
-                        np.random.normal(loc=0, scale=read_noise, size=spec_template_array.shape))
+    noisy_spec_array = np.random.poisson(np.abs(spec_template_array) / 2).astype(np.float32)
+    noisy_spec_array += np.random.normal(loc=0, scale=read_noise, size=spec_template_array.shape)
 
     halfheight = 30
 
@@ -454,7 +666,7 @@ def test_star_spectrum_registration(errortol_pix = 0.5):
     centroid_table.write(star_spec_centroid_table_fname, overwrite=True)
     print(f"Stored the centroid estimate table to {star_spec_centroid_table_fname}")
 
-def test_wave_cal(errortol_nm = 1.0, prism = 'PRISM3', zeropt = None, test_product_path = None):
+def test_wave_cal(spec_test_data, errortol_nm = 1.0, prism = 'PRISM3', zeropt = None, test_product_path = None):
     """
 
     Test the wave_cal_map() step function that computes the wavelength
@@ -466,6 +678,7 @@ def test_wave_cal(errortol_nm = 1.0, prism = 'PRISM3', zeropt = None, test_produ
     images.
 
     Args:
+        spec_test_data (_SpectroscopyTestData): reader for the shared spectroscopy test data
     
     errortol_nm (numpy.float): Tolerance on the worst-case wavelength
     disagreement between the input (TVAC) dispersion model and the estimated dispersion
@@ -497,11 +710,11 @@ def test_wave_cal(errortol_nm = 1.0, prism = 'PRISM3', zeropt = None, test_produ
         test_product_path,
         Path(prism_filtersweep_sim_fname).stem + '_wavecal.fits')   
 
-    prism_filtersweep_array = fits.getdata(prism_filtersweep_sim_fname, ext=0)
+    prism_filtersweep_array = spec_test_data.getdata(prism_filtersweep_sim_fname, ext=0)
     filtersweep_table = Table.read(prism_filtersweep_centroid_table_fname)
     filtersweep_table.add_index('CFAM')
     bandpass_center_table_fname = os.path.join(test_data_path, "CGI_bandpass_centers.csv")
-    bandpass_center_table = pd.read_csv(bandpass_center_table_fname, index_col=0)
+    bandpass_center_table = spec_test_data.read_csv(bandpass_center_table_fname)
     
     dispersion_params_fname = os.path.join(test_product_path, 'corgidrp_PRISM3_dispersion_profile.npz')
     disp_params = spectroscopy.DispersionModel(dispersion_params_fname)
@@ -559,9 +772,12 @@ def test_wave_cal(errortol_nm = 1.0, prism = 'PRISM3', zeropt = None, test_produ
     hdulist.writeto(wavecal_map_fname, overwrite=True)
     print(f"Wrote wavelength calibration map to {wavecal_map_fname}")
 
-def test_line_spread_function():
+def test_line_spread_function(spec_test_data):
     """
     Test the line spread function calibration 
+
+    Args:
+        spec_test_data (_SpectroscopyTestData): reader for the shared spectroscopy test data
     """
     print('Testing the line spread function calibration procedure...')
     test_data_path = os.path.join(os.path.dirname(corgidrp.__path__[0]), 
@@ -572,9 +788,9 @@ def test_line_spread_function():
     prism_slit_offset_psf_array_fname = os.path.join(test_data_path, 
             'g0v_vmag6_spc-spec_band3_unocc_CFAM3d_R1C2SLIT_PRISM3_offset_array.fits')
 
-    prism_slit_psf_array = fits.getdata(prism_slit_offset_psf_array_fname, ext=0)
-    centroid_table = Table(fits.getdata(prism_slit_offset_psf_array_fname , ext=1))    
-    prism_slit_psf_hdr = fits.getheader(prism_slit_offset_psf_array_fname, ext=0)
+    prism_slit_psf_array = spec_test_data.getdata(prism_slit_offset_psf_array_fname, ext=0)
+    centroid_table = Table(spec_test_data.getdata(prism_slit_offset_psf_array_fname, ext=1))    
+    prism_slit_psf_hdr = spec_test_data.getheader(prism_slit_offset_psf_array_fname, ext=0)
 
     prism = 'PRISM3'
     slitname = prism_slit_psf_hdr['SLIT'].strip()
@@ -635,28 +851,29 @@ def test_line_spread_function():
     print(f"Wrote line spread function array to {line_spread_func_fname}")
 
 if __name__ == "__main__":
-    # The test applied to spectroscopy.fit_psf_centroid() loads 
-    # a simulation file containing an array of PSFs computed for 
-    # a 2-D grid of sub-pixel offsets.
-    test_fit_psf_centroid(errortol_pix = 1E-2, verbose=False)
-
-    # Test the procedure for estimating the wavelength zero-point position, in
-    # practice either a DM satellite spot or PSF observed through the slit and
-    # narrowband filter.
-    test_zeropoint_centroid(errortol_pix = 0.5)
-
-    # Test the dispersion profile fitting function with an array
-    # of simulated PSF images for a set of sub-band color filters.
-    test_dispersion_fit(errortol_nm = 1.0)
-
-    # Test the wavelength calibration map function with the dispersion profile
-    # computed above and a wavelength zero-point test input.
-    test_wave_cal(errortol_nm = 1.0)
-
-    # Test the procedure for registering the unocculted star spectrum image from
-    # an array of raster scan offsets, choosing the prism image spectrum whose
-    # centroid best matches the wavelength calibration zero-point position.
-    test_star_spectrum_registration(errortol_pix = 0.5)
-
-    # Test the line spread function fit
-    test_line_spread_function()
+    with _SpectroscopyTestData() as spec_test_data:
+        # The test applied to spectroscopy.fit_psf_centroid() loads 
+        # a simulation file containing an array of PSFs computed for 
+        # a 2-D grid of sub-pixel offsets.
+        test_fit_psf_centroid(spec_test_data, errortol_pix = 1E-2, verbose=False)
+
+        # Test the procedure for estimating the wavelength zero-point position, in
+        # practice either a DM satellite spot or PSF observed through the slit and
+        # narrowband filter.
+        test_zeropoint_centroid(spec_test_data, errortol_pix = 0.5)
+
+        # Test the dispersion profile fitting function with an array
+        # of simulated PSF images for a set of sub-band color filters.
+        test_dispersion_fit(spec_test_data, errortol_nm = 1.0)
+
+        # Test the wavelength calibration map function with the dispersion profile
+        # computed above and a wavelength zero-point test input.
+        test_wave_cal(spec_test_data, errortol_nm = 1.0)
+
+        # Test the procedure for registering the unocculted star spectrum image from
+        # an array of raster scan offsets, choosing the prism image spectrum whose
+        # centroid best matches the wavelength calibration zero-point position.
+        test_star_spectrum_registration(spec_test_data, errortol_pix = 0.5)
+
+        # Test the line spread function fit
+        test_line_spread_function(spec_test_data)